@@ -1,9 +1,12 @@
+import os
 from logging.config import fileConfig
 
 from sqlalchemy import engine_from_config
+from sqlalchemy import inspect
 from sqlalchemy import pool
 
 from alembic import context
+from alembic.script import ScriptDirectory
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
@@ -21,6 +24,8 @@ if config.config_file_name is not None:
 from app.models import Base
 target_metadata = Base.metadata
 
+from app.config import SHARD_DATABASE_URLS
+
 
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
@@ -52,6 +57,30 @@ def run_migrations_offline() -> None:
         context.run_migrations()
 
 
+def _sync_url(url: str) -> str:
+    # The app uses async drivers; migrations run on the sync ones
+    return url.replace("+asyncpg", "").replace("+aiosqlite", "")
+
+
+def _shard_urls() -> list:
+    # With SHARD_DATABASE_URLS set, every shard is migrated (shard 0 first);
+    # otherwise the single database from alembic.ini
+    if os.getenv("SHARD_DATABASE_URLS"):
+        return [_sync_url(url) for url in SHARD_DATABASE_URLS]
+    return [config.get_main_option("sqlalchemy.url")]
+
+
+def _created_by_app(connection, shard_index: int) -> bool:
+    # A shard added after the others already got its tables from the API's
+    # create_all at startup (current schema, id range set by ensure_id_range)
+    # and has never seen Alembic. Shard 0 is the original database, which an
+    # older version may have created, so it always runs the migrations.
+    if shard_index == 0:
+        return False
+    tables = inspect(connection)
+    return not tables.has_table("alembic_version") and tables.has_table("chatrooms")
+
+
 def run_migrations_online() -> None:
     """Run migrations in 'online' mode.
 
@@ -59,19 +88,33 @@ def run_migrations_online() -> None:
     and associate a connection with the context.
 
     """
-    connectable = engine_from_config(
-        config.get_section(config.config_ini_section, {}),
-        prefix="sqlalchemy.",
-        poolclass=pool.NullPool,
-    )
-
-    with connectable.connect() as connection:
-        context.configure(
-            connection=connection, target_metadata=target_metadata
+    for shard_index, url in enumerate(_shard_urls()):
+        # Read by migrations that differ per shard (id ranges)
+        config.attributes["shard_index"] = shard_index
+        section = config.get_section(config.config_ini_section, {})
+        section["sqlalchemy.url"] = url
+        connectable = engine_from_config(
+            section,
+            prefix="sqlalchemy.",
+            poolclass=pool.NullPool,
         )
 
-        with context.begin_transaction():
-            context.run_migrations()
+        with connectable.connect() as connection:
+            created_by_app = _created_by_app(connection, shard_index)
+
+        with connectable.connect() as connection:
+            context.configure(
+                connection=connection, target_metadata=target_metadata
+            )
+
+            if created_by_app:
+                # Replaying the chain would fail on tables and columns that already exist
+                with connection.begin():
+                    context.get_context().stamp(ScriptDirectory.from_config(config), "head")
+                continue
+
+            with context.begin_transaction():
+                context.run_migrations()
 
 
 if context.is_offline_mode():
@@ -0,0 +1,52 @@
+"""Add chatroom summary columns
+
+Revision ID: 3c1f8e2a9b47
+Revises: 66afd19add1e
+Create Date: 2026-10-19 10:10:12.418230
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3c1f8e2a9b47'
+down_revision: Union[str, Sequence[str], None] = '66afd19add1e'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('chatrooms', sa.Column('last_message_at', sa.DateTime(), nullable=True))
+    op.add_column('chatrooms', sa.Column('last_message_preview', sa.String(), nullable=True))
+    op.add_column('chatrooms', sa.Column('message_count', sa.Integer(), server_default='0', nullable=False))
+
+    # Backfill from existing messages (one-off; afterwards maintained on insert)
+    op.execute(
+        """
+        UPDATE chatrooms SET
+            message_count = (SELECT count(*) FROM messages m WHERE m.chatroom_id = chatrooms.id),
+            last_message_at = COALESCE(
+                (SELECT max(m.created_at) FROM messages m WHERE m.chatroom_id = chatrooms.id),
+                chatrooms.created_at
+            ),
+            last_message_preview = (
+                SELECT substr(m.content, 1, 100) FROM messages m
+                WHERE m.chatroom_id = chatrooms.id
+                ORDER BY m.created_at DESC, m.id DESC LIMIT 1
+            )
+        """
+    )
+
+    op.create_index('ix_chatrooms_user_id_last_message_at', 'chatrooms', ['user_id', 'last_message_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_chatrooms_user_id_last_message_at', table_name='chatrooms')
+    op.drop_column('chatrooms', 'message_count')
+    op.drop_column('chatrooms', 'last_message_preview')
+    op.drop_column('chatrooms', 'last_message_at')
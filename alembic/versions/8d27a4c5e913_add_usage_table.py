@@ -0,0 +1,40 @@
+"""Add usage table
+
+Revision ID: 8d27a4c5e913
+Revises: 3c1f8e2a9b47
+Create Date: 2026-10-19 10:31:47.902114
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8d27a4c5e913'
+down_revision: Union[str, Sequence[str], None] = '3c1f8e2a9b47'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'usage',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.Column('tier', sa.String(), nullable=True),
+        sa.Column('day', sa.Date(), nullable=True),
+        sa.Column('prompt_tokens', sa.BigInteger(), server_default='0', nullable=False),
+        sa.Column('completion_tokens', sa.BigInteger(), server_default='0', nullable=False),
+        sa.Column('calls', sa.Integer(), server_default='0', nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('user_id', 'tier', 'day', name='uq_usage_user_tier_day')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('usage')
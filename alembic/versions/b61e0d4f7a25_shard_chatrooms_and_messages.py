@@ -0,0 +1,57 @@
+"""Shard chatrooms and messages
+
+Revision ID: b61e0d4f7a25
+Revises: 8d27a4c5e913
+Create Date: 2026-10-19 14:12:05.318640
+
+"""
+from typing import Sequence, Union
+
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b61e0d4f7a25'
+down_revision: Union[str, Sequence[str], None] = '8d27a4c5e913'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Same as app.sharding.ID_RANGE (copied so the migration never changes with the app)
+ID_RANGE = 10 ** 12
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Users stay in the directory database (shard 0), so chatrooms and
+    # messages on other shards cannot reference them
+    op.drop_constraint('chatrooms_user_id_fkey', 'chatrooms', type_='foreignkey')
+    op.drop_constraint('messages_user_id_fkey', 'messages', type_='foreignkey')
+
+    # Ids above 2**31 once shard ranges are in use
+    op.alter_column('chatrooms', 'id', type_=sa.BigInteger(), existing_type=sa.Integer())
+    op.alter_column('messages', 'id', type_=sa.BigInteger(), existing_type=sa.Integer())
+    op.alter_column('messages', 'chatroom_id', type_=sa.BigInteger(), existing_type=sa.Integer())
+    op.execute("ALTER SEQUENCE chatrooms_id_seq AS bigint")
+    op.execute("ALTER SEQUENCE messages_id_seq AS bigint")
+
+    # Shard N hands out ids from N * ID_RANGE, so moved rows keep their ids
+    # (alembic/env.py sets shard_index when migrating SHARD_DATABASE_URLS)
+    shard_index = context.config.attributes.get("shard_index", 0)
+    if shard_index:
+        for table in ('chatrooms', 'messages'):
+            op.execute(
+                f"SELECT setval('{table}_id_seq', "
+                f"GREATEST((SELECT COALESCE(MAX(id), 0) FROM {table}), {shard_index * ID_RANGE}))"
+            )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("ALTER SEQUENCE messages_id_seq AS integer")
+    op.execute("ALTER SEQUENCE chatrooms_id_seq AS integer")
+    op.alter_column('messages', 'chatroom_id', type_=sa.Integer(), existing_type=sa.BigInteger())
+    op.alter_column('messages', 'id', type_=sa.Integer(), existing_type=sa.BigInteger())
+    op.alter_column('chatrooms', 'id', type_=sa.Integer(), existing_type=sa.BigInteger())
+    op.create_foreign_key('messages_user_id_fkey', 'messages', 'users', ['user_id'], ['id'])
+    op.create_foreign_key('chatrooms_user_id_fkey', 'chatrooms', 'users', ['user_id'], ['id'])
@@ -0,0 +1,34 @@
+"""Add user_shards table
+
+Revision ID: c8e31f0a6d52
+Revises: e4a9c27d5b13
+Create Date: 2026-10-19 17:24:09.531846
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c8e31f0a6d52'
+down_revision: Union[str, Sequence[str], None] = 'e4a9c27d5b13'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'user_shards',
+        sa.Column('user_id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('shard', sa.Integer(), nullable=True),
+        sa.Column('moving_to', sa.Integer(), nullable=True),
+        sa.PrimaryKeyConstraint('user_id')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('user_shards')
@@ -0,0 +1,32 @@
+"""Add id to the chatroom activity index
+
+Revision ID: f2b7d48e9c16
+Revises: c8e31f0a6d52
+Create Date: 2026-10-19 19:41:27.604913
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f2b7d48e9c16'
+down_revision: Union[str, Sequence[str], None] = 'c8e31f0a6d52'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # list_chatrooms orders by (last_message_at, id); with id in the index it
+    # is still served without a sort
+    op.create_index('ix_chatrooms_user_id_last_message_at_id', 'chatrooms', ['user_id', 'last_message_at', 'id'], unique=False)
+    op.drop_index('ix_chatrooms_user_id_last_message_at', table_name='chatrooms')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.create_index('ix_chatrooms_user_id_last_message_at', 'chatrooms', ['user_id', 'last_message_at'], unique=False)
+    op.drop_index('ix_chatrooms_user_id_last_message_at_id', table_name='chatrooms')
@@ -4,3 +4,81 @@ import os
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
+# Chatrooms and messages are spread over these databases by user id (see
+# app/sharding.py). The first one also holds users, OTPs, subscriptions and
+# usage. Defaults to DATABASE_URL alone, i.e. no sharding.
+SHARD_DATABASE_URLS = [
+    url.strip() for url in os.getenv("SHARD_DATABASE_URLS", "").split(",") if url.strip()
+] or [DATABASE_URL]
+SHARD_VIRTUAL_NODES = int(os.getenv("SHARD_VIRTUAL_NODES", "128"))
+# How long Redis caches a user's shard override (the user_shards table is authoritative)
+SHARD_CACHE_TTL = int(os.getenv("SHARD_CACHE_TTL", "3600"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL", REDIS_URL)
+
+# Connection pools are sized per worker process (multiply by the worker count
+# to get the total number of connections a deployment can open).
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "50"))
+
+# WebSocket fan-out: events buffered per socket before a slow client is dropped,
+# and how long a single send may block
+WS_QUEUE_SIZE = int(os.getenv("WS_QUEUE_SIZE", "100"))
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "5"))
+
+# Gemini API (point GEMINI_API_URL at scripts/gemini_stub.py for local fault testing)
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+GEMINI_API_URL = os.getenv("GEMINI_API_URL", "https://generativelanguage.googleapis.com/v1beta")
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
+GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", "60"))
+GEMINI_HISTORY_MESSAGES = int(os.getenv("GEMINI_HISTORY_MESSAGES", "20"))
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "8"))
+
+# Adaptive concurrency (AIMD) for Gemini calls, per worker process
+GEMINI_MIN_CONCURRENCY = int(os.getenv("GEMINI_MIN_CONCURRENCY", "1"))
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "32"))
+GEMINI_INITIAL_CONCURRENCY = int(os.getenv("GEMINI_INITIAL_CONCURRENCY", "4"))
+GEMINI_LATENCY_TARGET = float(os.getenv("GEMINI_LATENCY_TARGET", "10"))  # seconds
+
+# Circuit breaker for Gemini calls
+GEMINI_BREAKER_THRESHOLD = int(os.getenv("GEMINI_BREAKER_THRESHOLD", "5"))  # consecutive failures
+GEMINI_BREAKER_RESET = float(os.getenv("GEMINI_BREAKER_RESET", "30"))  # seconds open before a probe
+
+# Token usage metering: seconds between flushes of Redis counters to Postgres,
+# and how many users one flush handles
+USAGE_FLUSH_INTERVAL = float(os.getenv("USAGE_FLUSH_INTERVAL", "30"))
+USAGE_FLUSH_BATCH = int(os.getenv("USAGE_FLUSH_BATCH", "500"))
+
+# Password hashing (argon2id). Changing the cost parameters makes existing
+# hashes get upgraded the next time the password is verified.
+PASSWORD_HASH_TIME_COST = int(os.getenv("PASSWORD_HASH_TIME_COST", "3"))
+PASSWORD_HASH_MEMORY_COST = int(os.getenv("PASSWORD_HASH_MEMORY_COST", "65536"))  # KiB
+PASSWORD_HASH_PARALLELISM = int(os.getenv("PASSWORD_HASH_PARALLELISM", "1"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 2)))
+
+# Idempotency-Key handling for message sends: how long a stored response is
+# replayed, how long an in-flight claim lives, and how long a duplicate waits
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", "86400"))
+IDEMPOTENCY_LOCK_TTL = int(os.getenv("IDEMPOTENCY_LOCK_TTL", "60"))
+IDEMPOTENCY_WAIT_TIMEOUT = float(os.getenv("IDEMPOTENCY_WAIT_TIMEOUT", "30"))
+
+# Retrieval over older chatroom messages for Gemini context (off by default)
+RAG_ENABLED = os.getenv("RAG_ENABLED", "false").lower() == "true"
+RAG_TOP_K = int(os.getenv("RAG_TOP_K", "5"))
+EMBEDDER = os.getenv("EMBEDDER", "hash")  # "hash" (local, no API calls) or "gemini"
+# Index size and search time scale with this: 100k messages x 64 dims is 24 MiB,
+# read in full by every search (scripts/bench_vector_index.py)
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", "64"))
+GEMINI_EMBEDDING_MODEL = os.getenv("GEMINI_EMBEDDING_MODEL", "text-embedding-004")
+VECTOR_INDEX_DIR = os.getenv("VECTOR_INDEX_DIR", "data/vector_index")
+VECTOR_INDEX_CACHE = int(os.getenv("VECTOR_INDEX_CACHE", "128"))  # open chatroom indexes per process
+
+# Logging: records go through a bounded in-memory queue to a background
+# thread, so a slow stdout never blocks requests (records are dropped instead).
+# SQL statements and DEBUG records are sampled per request id at these rates.
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # "json" or "text"
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_SQL_SAMPLE_RATE = float(os.getenv("LOG_SQL_SAMPLE_RATE", "0"))  # 0 turns SQL logging off
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "0.1"))
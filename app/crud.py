@@ -1 +1,29 @@
-# TODO: Implement
\ No newline at end of file
+from sqlalchemy import update, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import Chatroom, Message
+
+PREVIEW_LENGTH = 100  # Characters of the last message shown in chatroom lists
+
+async def add_message(db: AsyncSession, chatroom_id: int, user_id: int, content: str, role: str) -> Message:
+    """
+    Adds a message and updates the chatroom summary in the same transaction.
+    The caller commits.
+    """
+    message = Message(
+        chatroom_id=chatroom_id,
+        user_id=user_id,
+        content=content,
+        role=role
+    )
+    db.add(message)
+    await db.execute(
+        update(Chatroom)
+        .where(Chatroom.id == chatroom_id)
+        .values(
+            last_message_at=func.now(),
+            last_message_preview=content[:PREVIEW_LENGTH],
+            message_count=Chatroom.message_count + 1,
+        )
+    )
+    return message
@@ -1,11 +1,25 @@
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.orm import sessionmaker
-from .config import DATABASE_URL
+from fastapi import Depends, HTTPException, Request, status
 
-engine = create_async_engine(DATABASE_URL, echo=True)
-AsyncSessionLocal = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+from app.dependencies import get_current_user, get_redis
+from app.resources import resources
+from app.sharding import resolve_shard
 
-# Dependency to get DB session
-async def get_db():
-    async with AsyncSessionLocal() as session:
+READ_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+# Dependency to get a DB session on the authenticated user's shard (chatrooms, messages)
+async def get_db(request: Request, user_id: str = Depends(get_current_user), redis_client = Depends(get_redis)):
+    shard, moving = await resolve_shard(redis_client, user_id)
+    if moving and request.method not in READ_METHODS:
+        # scripts/rebalance_user.py is copying this user's rows; reads still work
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Account data is being moved, please retry shortly",
+            headers={"Retry-After": "5"},
+        )
+    async with resources.session_factories[shard]() as session:
+        yield session
+
+# Dependency to get a DB session on the directory database (users, OTPs, subscriptions, usage)
+async def get_directory_db():
+    async with resources.session_factory() as session:
         yield session
@@ -2,21 +2,35 @@ from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from jose import jwt, JWTError
 from app.utils.jwt import SECRET_KEY, ALGORITHM
+from app.resources import resources
 
 oauth2_scheme = HTTPBearer()
 
+def decode_user_id(token: str):
+    """
+    Returns the user id (JWT `sub`) for a valid token, or None.
+    """
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+    return payload.get("sub")
+
 def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(oauth2_scheme)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        token = credentials.credentials  # This is the actual JWT token
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: str = payload.get("sub")
-        if user_id is None:
-            raise credentials_exception
-        return user_id
-    except JWTError:
+    token = credentials.credentials  # This is the actual JWT token
+    user_id: str = decode_user_id(token)
+    if user_id is None:
         raise credentials_exception
+    return user_id
+
+# Shared clients created per worker by the lifespan (see app/resources.py)
+def get_redis():
+    return resources.redis
+
+def get_chatroom_hub():
+    return resources.hub
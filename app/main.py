@@ -1,16 +1,44 @@
-from fastapi import FastAPI
+import json
+import logging
+import time
+from contextlib import asynccontextmanager
+
+from fastapi import Depends, FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 
-from app.database import engine
 from app.models import Base
+from app.resources import resources
+from app.sharding import ensure_id_range
+from app.dependencies import get_redis
+from app.tasks import METRICS_KEY, METRICS_TTL
+from app.utils.log import request_id_var, new_request_id, setup_logging, shutdown_logging
 
 # Import routers
-from app.routes import auth, chatroom, message, subscription, webhook, user
+from app.routes import auth, chatroom, message, subscription, webhook, user, usage
+
+access_logger = logging.getLogger("app.access")
+
+# Build pools per worker (after fork) and drain them on shutdown
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    setup_logging()
+    await resources.startup()
+    # Auto-create tables on startup, on every shard (development only);
+    # either way each shard must hand out ids from its own range
+    for shard, engine in enumerate(resources.engines):
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+            await conn.run_sync(ensure_id_range, shard)
+    yield
+    await resources.shutdown()
+    shutdown_logging()
 
 app = FastAPI(
     title="Gemini Backend",
     description="API for Gemini Chat Application",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # CORS middleware (adjust allow_origins in production)
@@ -22,11 +50,31 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Auto-create tables on startup (development only)
-@app.on_event("startup")
-async def on_startup():
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+# Compress larger JSON bodies (chatroom lists, message histories) for clients sending Accept-Encoding: gzip
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
+# Request id for every log record of the request (and the Celery tasks it
+# enqueues), echoed back as X-Request-ID; one structured access record each
+@app.middleware("http")
+async def request_context(request: Request, call_next):
+    request_id = new_request_id(request.headers.get("x-request-id"))
+    token = request_id_var.set(request_id)
+    started = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        response.headers["X-Request-ID"] = request_id
+        return response
+    finally:
+        access_logger.info(
+            "%s %s %d", request.method, request.url.path, status_code,
+            extra={
+                "method": request.method, "path": request.url.path, "status": status_code,
+                "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+            },
+        )
+        request_id_var.reset(token)
 
 # Include routers with correct prefixes
 app.include_router(auth.router, prefix="/auth", tags=["auth"])
@@ -35,8 +83,24 @@ app.include_router(message.router, tags=["message"])  # No prefix, endpoints are
 app.include_router(subscription.router)  # Handles /subscribe/pro, /subscription/status, /subscriptions/my
 app.include_router(webhook.router)       # Handles /webhook/stripe
 app.include_router(user.router, prefix="/user", tags=["user"])  # Enables /user/me
+app.include_router(usage.router, tags=["usage"])  # Handles /usage/my
 
 # Root endpoint for health check
 @app.get("/", tags=["health"])
 def health_check():
     return {"status": "ok"}
+
+# Gemini client state reported by each Celery worker process (concurrency limit, breaker)
+@app.get("/metrics/gemini", tags=["health"])
+async def gemini_metrics(redis_client = Depends(get_redis)):
+    workers, stale = {}, []
+    now = time.time()
+    for worker, report in (await redis_client.hgetall(METRICS_KEY)).items():
+        report = json.loads(report)
+        if now - report.get("reported_at", 0) > METRICS_TTL:
+            stale.append(worker)  # the process exited or stopped taking tasks
+        else:
+            workers[worker] = report
+    if stale:
+        await redis_client.hdel(METRICS_KEY, *stale)
+    return {"workers": workers}
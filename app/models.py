@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, func
+from sqlalchemy import Column, Integer, BigInteger, String, ForeignKey, Date, DateTime, Index, UniqueConstraint, func
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 
@@ -18,22 +18,46 @@ class OTP(Base):
     otp = Column(String)
     expires_at = Column(DateTime)
 
+# Chatrooms and messages live on the owner's shard while users stay in the
+# directory database, so their user_id columns carry no foreign key (app/sharding.py)
 class Chatroom(Base):
     __tablename__ = "chatrooms"
-    id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, ForeignKey("users.id"))
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True)
+    user_id = Column(Integer)
     name = Column(String)
     created_at = Column(DateTime, default=func.now())
+    # Summary kept up to date by crud.add_message (same transaction as the insert).
+    # last_message_at starts at creation time so it always reflects recent activity.
+    last_message_at = Column(DateTime, default=func.now())
+    last_message_preview = Column(String, nullable=True)
+    message_count = Column(Integer, default=0, server_default="0", nullable=False)
+
+    __table_args__ = (
+        # id breaks ties between equal timestamps (SQLite stores whole seconds)
+        Index("ix_chatrooms_user_id_last_message_at_id", "user_id", "last_message_at", "id"),
+        # SQLite keeps a settable id counter only for AUTOINCREMENT tables (shard id ranges)
+        {"sqlite_autoincrement": True},
+    )
 
 class Message(Base):
     __tablename__ = "messages"
-    id = Column(Integer, primary_key=True)
-    chatroom_id = Column(Integer, ForeignKey("chatrooms.id"))
-    user_id = Column(Integer, ForeignKey("users.id"))
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True)
+    chatroom_id = Column(BigInteger, ForeignKey("chatrooms.id"))
+    user_id = Column(Integer)
     content = Column(String)
     role = Column(String)  # 'user' or 'ai'
     created_at = Column(DateTime, default=func.now())
 
+    __table_args__ = ({"sqlite_autoincrement": True},)
+
+class UserShard(Base):
+    __tablename__ = "user_shards"
+    # Directory database only: users pinned or moved off the ring's shard, and
+    # users whose rows are being moved (cached in Redis, see app/sharding.py)
+    user_id = Column(Integer, primary_key=True, autoincrement=False)
+    shard = Column(Integer, nullable=True)
+    moving_to = Column(Integer, nullable=True)
+
 class Subscription(Base):
     __tablename__ = "subscriptions"
     id = Column(Integer, primary_key=True)
@@ -41,3 +65,24 @@ class Subscription(Base):
     tier = Column(String)
     stripe_id = Column(String)
     status = Column(String)
+
+class Usage(Base):
+    __tablename__ = "usage"
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    tier = Column(String)
+    day = Column(Date)
+    # Flushed in batches from Redis counters (see app/utils/metering.py)
+    prompt_tokens = Column(BigInteger, default=0, server_default="0", nullable=False)
+    completion_tokens = Column(BigInteger, default=0, server_default="0", nullable=False)
+    calls = Column(Integer, default=0, server_default="0", nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("user_id", "tier", "day", name="uq_usage_user_tier_day"),
+    )
+
+class UsageFlush(Base):
+    __tablename__ = "usage_flushes"
+    # Last Redis flush generation added to `usage`, so a flush is applied once
+    user_id = Column(Integer, primary_key=True, autoincrement=False)
+    generation = Column(BigInteger, nullable=False)
@@ -1 +1,51 @@
-# TODO: Implement
\ No newline at end of file
+# app/queue/worker.py
+#
+# Async runtime for Celery workers. Tasks are plain functions, but the database
+# layer is async (asyncpg), so each worker process runs one event loop in a
+# background thread and tasks submit coroutines to it with run_async(). This
+# works with the prefork, solo and threads pools alike.
+
+import asyncio
+import threading
+
+from celery.signals import worker_process_shutdown, worker_shutdown
+
+from app.resources import resources
+from app.utils.log import request_id_var
+
+_loop = None
+_lock = threading.Lock()
+
+def _get_loop():
+    global _loop
+    with _lock:
+        if _loop is None:
+            # First use in this process (after fork): start the loop and the engine
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="worker-async", daemon=True).start()
+            resources.open_database()
+        return _loop
+
+async def _with_request_id(coro, request_id):
+    # Tasks on the loop thread do not inherit the calling task's context
+    request_id_var.set(request_id)
+    return await coro
+
+def run_async(coro):
+    """
+    Runs a coroutine on the worker's event loop and returns its result.
+    """
+    return asyncio.run_coroutine_threadsafe(_with_request_id(coro, request_id_var.get()), _get_loop()).result()
+
+@worker_process_shutdown.connect
+@worker_shutdown.connect
+def close_worker_resources(**kwargs):
+    global _loop
+    with _lock:
+        loop, _loop = _loop, None
+    resources.close_clients()
+    if loop is None:
+        return
+    for engine in resources.engines:
+        asyncio.run_coroutine_threadsafe(engine.dispose(), loop).result(timeout=10)
+    loop.call_soon_threadsafe(loop.stop)
@@ -0,0 +1,143 @@
+# app/resources.py
+
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import redis
+import redis.asyncio as aioredis
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from app.config import (
+    SHARD_DATABASE_URLS, REDIS_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW,
+    REDIS_MAX_CONNECTIONS, WS_QUEUE_SIZE, EMBEDDER, PASSWORD_HASH_WORKERS,
+)
+from app.utils.embeddings import EMBEDDERS, Embedder
+from app.utils.gemini import GeminiClient
+from app.utils.pubsub import ChatroomHub
+
+logger = logging.getLogger(__name__)
+
+
+class Resources:
+    """
+    Registry of the connection pools shared by one worker process.
+
+    Nothing here is created at import time: under gunicorn/uvicorn with several
+    workers the app module may be imported before fork, and sockets opened in
+    the parent must not be shared by the children. `startup()` runs from the
+    FastAPI lifespan inside each worker, `shutdown()` closes everything.
+
+    The server drains requests before the lifespan shutdown runs (uvicorn
+    closes its sockets and waits for open connections first, bounded by
+    --timeout-graceful-shutdown / gunicorn --graceful-timeout), so nothing
+    here is still serving a request when the pools close.
+
+    The blocking clients used from threads (Celery tasks, the password pool)
+    are built by their property on first use, in the process that uses them;
+    `close_clients()` releases them.
+    """
+
+    def __init__(self):
+        self.engine = None
+        self.session_factory = None
+        self.engines = []
+        self.session_factories = []
+        self.redis = None
+        self.hub = None
+        self._clients = {}
+        self._clients_lock = threading.Lock()
+
+    def _client(self, name, build):
+        with self._clients_lock:
+            client = self._clients.get(name)
+            if client is None:
+                client = self._clients[name] = build()
+            return client
+
+    @property
+    def sync_redis(self) -> redis.Redis:
+        # Celery tasks are synchronous; the API uses `self.redis`
+        return self._client("sync_redis", lambda: redis.Redis.from_url(REDIS_URL, decode_responses=True))
+
+    @property
+    def gemini(self) -> GeminiClient:
+        return self._client("gemini", GeminiClient)
+
+    @property
+    def embedder(self) -> Embedder:
+        return self._client("embedder", EMBEDDERS[EMBEDDER])
+
+    @property
+    def password_executor(self) -> ThreadPoolExecutor:
+        return self._client("password_executor", lambda: ThreadPoolExecutor(
+            max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="passwords"
+        ))
+
+    def close_clients(self):
+        with self._clients_lock:
+            clients, self._clients = self._clients, {}
+        for client in clients.values():
+            # Executors have shutdown() (waits for running jobs) instead of close()
+            close = getattr(client, "close", None) or client.shutdown
+            close()
+
+    def open_database(self):
+        # Also used on its own by Celery workers (app/queue/worker.py)
+        self.engines = [
+            # SQL logging is sampled through app.utils.log (LOG_SQL_SAMPLE_RATE), not echo
+            create_async_engine(url, **_pool_options(url)) for url in SHARD_DATABASE_URLS
+        ]
+        self.session_factories = [
+            sessionmaker(engine, expire_on_commit=False, class_=AsyncSession) for engine in self.engines
+        ]
+        # Shard 0 doubles as the directory database (users, OTPs, subscriptions, usage)
+        self.engine = self.engines[0]
+        self.session_factory = self.session_factories[0]
+
+    async def startup(self):
+        self.open_database()
+        self.redis = aioredis.from_url(
+            REDIS_URL, decode_responses=True, max_connections=REDIS_MAX_CONNECTIONS
+        )
+        self.hub = ChatroomHub(self.redis, queue_size=WS_QUEUE_SIZE)
+        await self.hub.start()
+
+        # Open the Celery producer connection in this process (not the parent)
+        from app.tasks import celery_app
+        await asyncio.to_thread(_warm_celery_producer, celery_app)
+
+    async def shutdown(self):
+        from app.tasks import celery_app
+        celery_app.close()
+        if self.hub is not None:
+            await self.hub.stop()
+        if self.redis is not None:
+            await self.redis.aclose()
+        for engine in self.engines:
+            await engine.dispose()
+        await asyncio.to_thread(self.close_clients)
+        self.engine = self.session_factory = self.redis = self.hub = None
+        self.engines, self.session_factories = [], []
+
+
+def _pool_options(url: str) -> dict:
+    # SQLite (local development) has no connection pool to size
+    if url.startswith("sqlite"):
+        return {}
+    return {"pool_size": DB_POOL_SIZE, "max_overflow": DB_MAX_OVERFLOW, "pool_pre_ping": True}
+
+
+def _warm_celery_producer(celery_app):
+    try:
+        with celery_app.producer_or_acquire() as producer:
+            producer.connection.ensure_connection(max_retries=1)
+    except Exception:
+        # The broker may come up after the API; delay() will retry on first use
+        logger.warning("Celery broker not reachable at startup", exc_info=True)
+
+
+# One registry per process, populated by the lifespan in app.main
+resources = Resources()
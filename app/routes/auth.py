@@ -3,7 +3,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from datetime import datetime
 
-from app.database import get_db
+from app.database import get_directory_db
 from app.models import User, OTP
 from app.schemas import (
     OTPCreate, OTPVerify, SignupRequest, ForgotPasswordRequest,
@@ -11,13 +11,14 @@ from app.schemas import (
 )
 from app.utils.otp import generate_otp, get_expiry
 from app.utils.jwt import create_access_token
+from app.utils.passwords import hash_password, verify_password
 from app.dependencies import get_current_user
 
 router = APIRouter()
 
 # 1. Signup endpoint
 @router.post("/signup")
-async def signup(data: SignupRequest, db: AsyncSession = Depends(get_db)):
+async def signup(data: SignupRequest, db: AsyncSession = Depends(get_directory_db)):
     """
     Registers a new user with mobile number and optional info.
     """
@@ -26,6 +27,8 @@ async def signup(data: SignupRequest, db: AsyncSession = Depends(get_db)):
     if user:
         raise HTTPException(status_code=400, detail="User already exists")
     user = User(mobile=data.mobile)
+    if data.password:
+        user.password_hash = await hash_password(data.password)
     db.add(user)
     await db.commit()
     await db.refresh(user)
@@ -33,7 +36,7 @@ async def signup(data: SignupRequest, db: AsyncSession = Depends(get_db)):
 
 # 2. Send OTP (login)
 @router.post("/send-otp")
-async def send_otp(data: OTPCreate, db: AsyncSession = Depends(get_db)):
+async def send_otp(data: OTPCreate, db: AsyncSession = Depends(get_directory_db)):
     """
     Sends an OTP to the user’s mobile number (mocked, returned in response).
     If user does not exist, create the user.
@@ -55,7 +58,7 @@ async def send_otp(data: OTPCreate, db: AsyncSession = Depends(get_db)):
 
 # 3. Verify OTP (login)
 @router.post("/verify-otp")
-async def verify_otp(data: OTPVerify, db: AsyncSession = Depends(get_db)):
+async def verify_otp(data: OTPVerify, db: AsyncSession = Depends(get_directory_db)):
     """
     Verifies the OTP and returns a JWT token for the session.
     """
@@ -78,7 +81,7 @@ async def verify_otp(data: OTPVerify, db: AsyncSession = Depends(get_db)):
 
 # 4. Forgot password (send OTP for password reset)
 @router.post("/forgot-password")
-async def forgot_password(data: ForgotPasswordRequest, db: AsyncSession = Depends(get_db)):
+async def forgot_password(data: ForgotPasswordRequest, db: AsyncSession = Depends(get_directory_db)):
     """
     Sends OTP for password reset.
     """
@@ -98,7 +101,7 @@ async def forgot_password(data: ForgotPasswordRequest, db: AsyncSession = Depend
 async def change_password(
     data: ChangePasswordRequest,
     user_id: str = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_directory_db)
 ):
     """
     Allows the user to change password while logged in.
@@ -107,8 +110,12 @@ async def change_password(
     user = result.scalar_one_or_none()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    # TODO: Validate old password if you store passwords
-    user.password = data.new_password  # Hash in real code!
+    # Accounts created through OTP login have no password yet; they can set one
+    if user.password_hash:
+        valid, _ = await verify_password(user.password_hash, data.old_password, rehash=False)
+        if not valid:
+            raise HTTPException(status_code=400, detail="Old password is incorrect")
+    user.password_hash = await hash_password(data.new_password)
     db.add(user)
     await db.commit()
     return {"message": "Password changed successfully."}
@@ -117,7 +124,7 @@ async def change_password(
 # @router.get("/me", response_model=UserOut)
 # async def get_me(
 #     user_id: str = Depends(get_current_user),
-#     db: AsyncSession = Depends(get_db)
+#     db: AsyncSession = Depends(get_directory_db)
 # ):
 #     """
 #     Returns details about the currently authenticated user.
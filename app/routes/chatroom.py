@@ -1,16 +1,17 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from app.database import get_db
 from app.models import Chatroom
-from app.schemas import ChatroomCreate, ChatroomOut, MessageCreate, MessageOut
-from app.dependencies import get_current_user
+from app.schemas import ChatroomCreate, ChatroomOut
+from app.dependencies import get_current_user, get_redis
 
 # For caching (e.g., Redis)
 from app.utils.cache import get_cached_chatrooms, set_cached_chatrooms
-
-# For Gemini queue (to be implemented)
-# from app.queue.worker import enqueue_gemini_task
+from app.utils.etag import (
+    user_version_key, chatroom_version_key, current_etag, bump_versions,
+    not_modified, set_etag,
+)
 
 router = APIRouter()
 
@@ -19,6 +20,7 @@ router = APIRouter()
 async def create_chatroom(
     chatroom: ChatroomCreate,
     db: AsyncSession = Depends(get_db),
+    redis_client = Depends(get_redis),
     user_id: str = Depends(get_current_user)
 ):
     """
@@ -28,86 +30,76 @@ async def create_chatroom(
     db.add(new_chatroom)
     await db.commit()
     await db.refresh(new_chatroom)
+    # Invalidate the chatroom list ETag for this user and start the chatroom's counter
+    await bump_versions(redis_client, user_version_key(user_id), chatroom_version_key(new_chatroom.id))
     # Invalidate chatroom cache for this user (if caching implemented)
-    # await set_cached_chatrooms(user_id, None)
+    # await set_cached_chatrooms(redis_client, user_id, None)
     return new_chatroom
 
 # 2. List all chatrooms (with caching)
 @router.get("", response_model=list[ChatroomOut])
 async def list_chatrooms(
+    request: Request,
+    response: Response,
     db: AsyncSession = Depends(get_db),
+    redis_client = Depends(get_redis),
     user_id: str = Depends(get_current_user)
 ):
     """
-    Lists all chatrooms for the authenticated user.
-    Uses caching for performance (per assignment).
+    Lists all chatrooms for the authenticated user, most recently active first,
+    with last-message preview and message count (no per-chatroom queries).
+    Answers 304 without querying Postgres when If-None-Match is current.
     """
+    etag = await current_etag(redis_client, user_version_key(user_id), user_id)
+    cached = not_modified(request, etag)
+    if cached is not None:
+        return cached
+
     # Try to get from cache first
-    # chatrooms = await get_cached_chatrooms(user_id)
+    # chatrooms = await get_cached_chatrooms(redis_client, user_id)
     # if chatrooms is not None:
     #     return chatrooms
 
-    result = await db.execute(select(Chatroom).where(Chatroom.user_id == int(user_id)))
+    # Served by ix_chatrooms_user_id_last_message_at_id
+    result = await db.execute(
+        select(Chatroom)
+        .where(Chatroom.user_id == int(user_id))
+        .order_by(Chatroom.last_message_at.desc(), Chatroom.id.desc())
+    )
     chatrooms = result.scalars().all()
 
     # Set cache for next time (TTL 5-10 min)
-    # await set_cached_chatrooms(user_id, chatrooms)
+    # await set_cached_chatrooms(redis_client, user_id, chatrooms)
+    set_etag(response, etag)
     return chatrooms
 
 # 3. Get a specific chatroom
 @router.get("/{chatroom_id}", response_model=ChatroomOut)
 async def get_chatroom(
     chatroom_id: int,
+    request: Request,
+    response: Response,
     db: AsyncSession = Depends(get_db),
+    redis_client = Depends(get_redis),
     user_id: str = Depends(get_current_user)
 ):
     """
     Retrieves detailed information about a specific chatroom.
+    Answers 304 without querying Postgres when If-None-Match is current.
     """
+    # The ETag includes the caller's id, so only a tag this user was sent can match
+    etag = await current_etag(redis_client, chatroom_version_key(chatroom_id), user_id, chatroom_id)
+    cached = not_modified(request, etag)
+    if cached is not None:
+        return cached
+
     result = await db.execute(
         select(Chatroom).where(Chatroom.id == chatroom_id, Chatroom.user_id == int(user_id))
     )
     chatroom = result.scalar_one_or_none()
     if not chatroom:
         raise HTTPException(status_code=404, detail="Chatroom not found")
+    set_etag(response, etag)
     return chatroom
 
-# 4. Send a message and receive Gemini response (async/queue)
-@router.post("/{chatroom_id}/message", response_model=MessageOut)
-async def send_message(
-    chatroom_id: int,
-    message: MessageCreate,
-    db: AsyncSession = Depends(get_db),
-    user_id: str = Depends(get_current_user)
-):
-    """
-    Sends a message and receives a Gemini response (via queue/async call).
-    """
-    # TODO: Enforce rate limiting for Basic users here
-
-    # Save user message to DB (implement your Message model and logic)
-    # user_message = Message(
-    #     chatroom_id=chatroom_id,
-    #     user_id=int(user_id),
-    #     content=message.content,
-    #     role="user"
-    # )
-    # db.add(user_message)
-    # await db.commit()
-    # await db.refresh(user_message)
-
-    # Enqueue Gemini API call (pseudo-code)
-    # task_id = enqueue_gemini_task(chatroom_id, user_message.id, message.content)
-
-    # Return message or task ID for polling (implement as needed)
-    # return {"task_id": task_id, "status": "pending"}
-
-    # For now, just return a placeholder
-    return {
-        "id": 1,
-        "chatroom_id": chatroom_id,
-        "user_id": user_id,
-        "content": message.content,
-        "role": "user",
-        "created_at": "2025-07-11T17:01:47.283843"
-    }
+# Sending messages lives in app/routes/message.py (REST and WebSocket)
@@ -1,30 +1,47 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+import asyncio
+import logging
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, Response, status, WebSocket, WebSocketDisconnect
+from pydantic import ValidationError
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from sqlalchemy import func
 from datetime import datetime, timedelta
 
-from app.database import get_db
+from app.config import WS_SEND_TIMEOUT
+from app.crud import add_message
+from app.database import get_db, get_directory_db
 from app.models import Message, Chatroom, User
+from app.resources import resources
 from app.schemas import MessageCreate, MessageOut
-from app.dependencies import get_current_user
+from app.dependencies import get_current_user, get_redis, get_chatroom_hub, decode_user_id
 from app.tasks import gemini_task  # Celery task
+from app.sharding import resolve_shard
+from app.utils.pubsub import publish_event
+from app.utils.log import request_id_var, new_request_id
+from app.utils import idempotency
+from app.utils.etag import (
+    user_version_key, chatroom_version_key, current_etag, bump_versions,
+    not_modified, set_etag,
+)
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
 DAILY_LIMIT = 5  # Basic plan daily message limit
 
-# 1. Send a message to a chatroom (and receive Gemini response via Celery)
-@router.post("/chatroom/{chatroom_id}/message", response_model=MessageOut)
-async def send_message(
-    chatroom_id: int,
-    message: MessageCreate,
-    db: AsyncSession = Depends(get_db),
-    user_id: str = Depends(get_current_user)
-):
-    """
-    Sends a message and receives a Gemini response (via queue/async call).
-    """
+# Shared by the REST and WebSocket endpoints: checks, saves, enqueues and announces a user message
+# `db` is on the user's shard, `directory_db` on the directory database (see app/sharding.py)
+async def create_user_message(db: AsyncSession, directory_db: AsyncSession, redis_client,
+                              chatroom_id: int, user_id: str, content: str):
+    new_message = await save_user_message(db, directory_db, chatroom_id, user_id, content)
+    await announce_user_message(redis_client, chatroom_id, user_id, new_message)
+    return new_message
+
+# Checks ownership and the Basic plan limit, then commits the message
+async def save_user_message(db: AsyncSession, directory_db: AsyncSession,
+                            chatroom_id: int, user_id: str, content: str):
     # Check if user owns the chatroom
     chatroom_result = await db.execute(
         select(Chatroom).where(Chatroom.id == chatroom_id, Chatroom.user_id == int(user_id))
@@ -34,17 +51,18 @@ async def send_message(
         raise HTTPException(status_code=404, detail="Chatroom not found or not owned by user")
 
     # Get user and check subscription
-    user_result = await db.execute(select(User).where(User.id == int(user_id)))
+    user_result = await directory_db.execute(select(User).where(User.id == int(user_id)))
     user = user_result.scalar_one_or_none()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
     # Rate limiting for Basic users
-    if user.subscription == "Basic":
+    if (user.subscription_tier or "basic").lower() == "basic":
         today = datetime.utcnow().date()
         count_result = await db.execute(
             select(func.count(Message.id)).where(
                 Message.user_id == int(user_id),
+                Message.role == "user",
                 Message.created_at >= today
             )
         )
@@ -55,33 +73,114 @@ async def send_message(
                 detail=f"Daily message limit ({DAILY_LIMIT}) reached for Basic plan."
             )
 
-    # Save user message to DB
-    new_message = Message(
-        chatroom_id=chatroom_id,
-        user_id=int(user_id),
-        content=message.content,
-        role="user"
-    )
-    db.add(new_message)
+    # Save user message to DB (and the chatroom summary, same transaction)
+    new_message = await add_message(db, chatroom_id, int(user_id), content, "user")
     await db.commit()
     await db.refresh(new_message)
+    return new_message
+
+# Side effects of a committed message. Only a failed enqueue is an error for
+# the client (it would never get a reply); the rest is logged
+async def announce_user_message(redis_client, chatroom_id: int, user_id: str, new_message: Message):
+    # Chatroom, its messages and the owner's chatroom list have all changed
+    try:
+        await bump_versions(redis_client, chatroom_version_key(chatroom_id), user_version_key(user_id))
+    except Exception:
+        logger.exception("Could not bump ETag versions for chatroom %s", chatroom_id)
 
     # Enqueue Gemini API call using Celery
-    gemini_task.delay(chatroom_id, new_message.id, message.content)
+    try:
+        gemini_task.delay(chatroom_id, new_message.id, new_message.content, int(user_id))
+    except Exception:
+        logger.exception("Could not enqueue a reply to message %s", new_message.id)
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Message saved, but its reply could not be queued",
+        )
+
+    # Let open sockets on any worker see the message
+    try:
+        await publish_event(redis_client, chatroom_id, {
+            "type": "message",
+            "message": MessageOut.model_validate(new_message).model_dump(mode="json"),
+        })
+    except Exception:
+        logger.exception("Could not publish message %s", new_message.id)
+
+# 1. Send a message to a chatroom (and receive Gemini response via Celery)
+@router.post("/chatroom/{chatroom_id}/message", response_model=MessageOut)
+async def send_message(
+    chatroom_id: int,
+    message: MessageCreate,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    db: AsyncSession = Depends(get_db),
+    directory_db: AsyncSession = Depends(get_directory_db),
+    redis_client = Depends(get_redis),
+    user_id: str = Depends(get_current_user)
+):
+    """
+    Sends a message and receives a Gemini response (via queue/async call).
+    With an Idempotency-Key header, retries return the original message
+    instead of saving it (and calling Gemini) again.
+    """
+    if not idempotency_key:
+        # Return the saved message (Gemini response will be added asynchronously)
+        return await create_user_message(db, directory_db, redis_client, chatroom_id, user_id, message.content)
+
+    scope = f"message:{user_id}"
+    request_fingerprint = idempotency.fingerprint(chatroom_id, message.content)
+    stored = await idempotency.claim(redis_client, scope, idempotency_key, request_fingerprint)
+    if stored is not None:
+        response.headers["Idempotent-Replayed"] = "true"
+        if stored["state"] == idempotency.DONE:
+            return stored["response"]
+        # Saved by an earlier attempt whose reply was never queued: queue it now
+        new_message = MessageOut.model_validate(stored["response"])
+    else:
+        try:
+            new_message = await save_user_message(db, directory_db, chatroom_id, user_id, message.content)
+        except Exception:
+            # Nothing was saved, so a retry with this key may do the work
+            await idempotency.release(redis_client, scope, idempotency_key)
+            raise
+        # Saved: from here on retries reuse this message instead of saving another
+        await idempotency.mark_saved(
+            redis_client, scope, idempotency_key, request_fingerprint,
+            MessageOut.model_validate(new_message).model_dump(mode="json")
+        )
 
-    # Return the saved message (Gemini response will be added asynchronously)
+    try:
+        await announce_user_message(redis_client, chatroom_id, user_id, new_message)
+    except Exception:
+        # The reply is not queued; the client's retry queues it
+        await idempotency.unlock(redis_client, scope, idempotency_key)
+        raise
+    await idempotency.complete(
+        redis_client, scope, idempotency_key, request_fingerprint,
+        MessageOut.model_validate(new_message).model_dump(mode="json")
+    )
     return new_message
 
 # 2. List all messages in a chatroom
 @router.get("/chatroom/{chatroom_id}/messages", response_model=list[MessageOut])
 async def get_messages(
     chatroom_id: int,
+    request: Request,
+    response: Response,
     db: AsyncSession = Depends(get_db),
+    redis_client = Depends(get_redis),
     user_id: str = Depends(get_current_user)
 ):
     """
     Lists all messages in a specific chatroom.
+    Answers 304 without querying Postgres when If-None-Match is current.
     """
+    etag = await current_etag(redis_client, chatroom_version_key(chatroom_id), user_id, chatroom_id)
+    cached = not_modified(request, etag)
+    if cached is not None:
+        return cached
+
     # Check if user owns the chatroom
     chatroom_result = await db.execute(
         select(Chatroom).where(Chatroom.id == chatroom_id, Chatroom.user_id == int(user_id))
@@ -93,4 +192,85 @@ async def get_messages(
     result = await db.execute(
         select(Message).where(Message.chatroom_id == chatroom_id)
     )
+    set_etag(response, etag)
     return result.scalars().all()
+
+# 3. Live chat over WebSocket (user messages in; messages and typing events out)
+@router.websocket("/chatroom/{chatroom_id}/ws")
+async def chatroom_socket(
+    websocket: WebSocket,
+    chatroom_id: int,
+    redis_client = Depends(get_redis),
+    hub = Depends(get_chatroom_hub),
+):
+    """
+    Authenticates once with the JWT (`?token=` or Authorization header), then
+    accepts `{"content": "..."}` frames and streams chatroom events:
+    `{"type": "message", "message": {...}}`, `{"type": "typing", "active": bool}`
+    and `{"type": "error", "status": int, "detail": str}`.
+    """
+    # One request id for the socket's lifetime (this handler runs in its own task)
+    request_id_var.set(new_request_id(websocket.headers.get("x-request-id")))
+    token = websocket.query_params.get("token")
+    auth_header = websocket.headers.get("authorization", "")
+    if not token and auth_header.lower().startswith("bearer "):
+        token = auth_header[7:]
+    user_id = decode_user_id(token) if token else None
+    if user_id is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    shard, _ = await resolve_shard(redis_client, user_id)
+    async with resources.session_factories[shard]() as db:
+        chatroom_result = await db.execute(
+            select(Chatroom.id).where(Chatroom.id == chatroom_id, Chatroom.user_id == int(user_id))
+        )
+        if chatroom_result.scalar_one_or_none() is None:
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+            return
+
+    await websocket.accept()
+    subscription = await hub.subscribe(chatroom_id)
+
+    # Error events for this socket go through its own queue, so that every
+    # send happens in send_events under WS_SEND_TIMEOUT
+    async def receive_messages():
+        while True:
+            data = await websocket.receive_text()
+            try:
+                # Malformed JSON is a ValidationError here too, not a crash of the socket
+                message = MessageCreate.model_validate_json(data)
+            except ValidationError:
+                subscription.offer({"type": "error", "status": 422, "detail": "Expected {\"content\": str}"})
+                continue
+            # Sessions per frame, so an idle socket does not hold DB connections
+            shard, moving = await resolve_shard(redis_client, user_id)
+            if moving:
+                subscription.offer({"type": "error", "status": 503, "detail": "Account data is being moved, please retry shortly"})
+                continue
+            async with resources.session_factories[shard]() as db, resources.session_factory() as directory_db:
+                try:
+                    await create_user_message(db, directory_db, redis_client, chatroom_id, user_id, message.content)
+                except HTTPException as exc:
+                    subscription.offer({"type": "error", "status": exc.status_code, "detail": exc.detail})
+
+    async def send_events():
+        while True:
+            event = await subscription.get()
+            if event is None:
+                # Client could not keep up; it should reconnect and reload history
+                await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+                return
+            await asyncio.wait_for(websocket.send_json(event), WS_SEND_TIMEOUT)
+
+    tasks = [asyncio.create_task(receive_messages()), asyncio.create_task(send_events())]
+    try:
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            exc = task.exception()
+            if exc is not None and not isinstance(exc, (WebSocketDisconnect, asyncio.TimeoutError)):
+                raise exc
+    finally:
+        for task in tasks:
+            task.cancel()
+        await hub.unsubscribe(subscription)
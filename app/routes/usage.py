@@ -0,0 +1,72 @@
+from datetime import datetime, timedelta
+
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.database import get_directory_db
+from app.models import Usage, UsageFlush
+from app.schemas import UsageOut
+from app.dependencies import get_current_user, get_redis
+from app.utils.metering import METRICS, read_hot_usage, merge_hot_usage, hot_usage_is_stale
+
+router = APIRouter()
+
+# Re-reads when a flush races the request; after that the live counters are left out
+HOT_USAGE_ATTEMPTS = 3
+
+# 1. Token usage for the current user (flushed totals + counters still in Redis)
+@router.get("/usage/my", response_model=list[UsageOut])
+async def my_usage(
+    days: int = Query(30, ge=1, le=366),
+    db: AsyncSession = Depends(get_directory_db),
+    redis_client = Depends(get_redis),
+    user_id: str = Depends(get_current_user)
+):
+    """
+    Returns prompt/completion tokens and call counts per day and tier, newest first.
+    """
+    since = datetime.utcnow().date() - timedelta(days=days - 1)
+    for _ in range(HOT_USAGE_ATTEMPTS):
+        # Redis first, then Postgres (see read_hot_usage)
+        hot = await read_hot_usage(redis_client, user_id)
+        # The applied generation comes from the same statement (same snapshot) as the rows
+        result = await db.execute(
+            select(Usage, UsageFlush.generation)
+            .outerjoin(UsageFlush, UsageFlush.user_id == Usage.user_id)
+            .where(Usage.user_id == int(user_id), Usage.day >= since)
+        )
+        totals = {}
+        applied_generation = None
+        for row, generation in result.all():
+            applied_generation = generation
+            totals[(row.day, row.tier)] = {
+                "prompt": row.prompt_tokens,
+                "completion": row.completion_tokens,
+                "calls": row.calls,
+            }
+        if not hot_usage_is_stale(hot, applied_generation):
+            hot_totals = merge_hot_usage(hot, applied_generation)
+            break
+        await db.rollback()  # a fresh snapshot for the next attempt
+    else:
+        # Still racing flushes: report what Postgres has rather than count twice
+        hot_totals = {}
+
+    for key, counts in hot_totals.items():
+        if key[0] < since:
+            continue
+        merged = totals.setdefault(key, dict.fromkeys(METRICS, 0))
+        for metric in METRICS:
+            merged[metric] += counts[metric]
+
+    return [
+        UsageOut(
+            day=day,
+            tier=tier,
+            prompt_tokens=counts["prompt"],
+            completion_tokens=counts["completion"],
+            calls=counts["calls"],
+        )
+        for (day, tier), counts in sorted(totals.items(), reverse=True)
+    ]
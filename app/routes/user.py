@@ -1,7 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from app.database import get_db
+from app.database import get_directory_db
 from app.models import User
 from app.schemas import UserOut
 from app.dependencies import get_current_user
@@ -11,7 +11,7 @@ router = APIRouter()
 @router.get("/me", response_model=UserOut)
 async def get_me(
     user_id: str = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_directory_db)
 ):
     """
     Returns details about the currently authenticated user.
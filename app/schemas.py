@@ -1,6 +1,6 @@
 from pydantic import BaseModel, Field
 from typing import Optional
-from datetime import datetime
+from datetime import date, datetime
 
 # ------------------- User Schemas -------------------
 
@@ -48,6 +48,9 @@ class ChatroomOut(BaseModel):
     id: int
     name: str
     created_at: datetime
+    last_message_at: Optional[datetime] = None
+    last_message_preview: Optional[str] = None
+    message_count: int = 0
 
     class Config:
         from_attributes = True
@@ -81,3 +84,12 @@ class SubscriptionOut(BaseModel):
     class Config:
         from_attributes = True
         # orm_mode = True
+
+# ------------------- Usage Schemas -------------------
+
+class UsageOut(BaseModel):
+    day: date
+    tier: str
+    prompt_tokens: int
+    completion_tokens: int
+    calls: int
@@ -0,0 +1,212 @@
+# app/sharding.py
+#
+# Routing of per-user data (chatrooms, messages) to one of several databases.
+#
+# A consistent-hash ring maps user ids to shard indexes, so adding a shard
+# only remaps about 1/N of the users (pin them to the shard holding their rows
+# first, with scripts/pin_shards.py). Users pinned or moved by
+# scripts/rebalance_user.py have a row in the directory database's
+# `user_shards` table; while a move is copying their rows, its `moving_to` is
+# set and writes are refused. Redis only caches those rows (`shard:user:<id>`),
+# so a flushed or evicted cache is rebuilt from the table.
+
+import bisect
+import hashlib
+
+from sqlalchemy import delete, event, select, text
+
+from app.config import SHARD_DATABASE_URLS, SHARD_VIRTUAL_NODES, SHARD_CACHE_TTL
+from app.models import Chatroom, Message, UserShard
+from app.queue.worker import run_async
+from app.resources import resources
+
+# Row ids on shard N start above N * ID_RANGE, so rows keep their ids when a
+# user is moved to another shard (set by the shard id-range migration, or by
+# ensure_id_range at startup for tables made by create_all)
+ID_RANGE = 10 ** 12
+ID_TABLES = ("chatrooms", "messages")
+DIRECTORY_SHARD = 0
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    def __init__(self, shard_count: int, virtual_nodes: int = SHARD_VIRTUAL_NODES):
+        self.shard_count = shard_count
+        points = sorted(
+            (_hash(f"shard-{shard}-vnode-{i}"), shard)
+            for shard in range(shard_count)
+            for i in range(virtual_nodes)
+        )
+        self._keys = [point for point, _ in points]
+        self._shards = [shard for _, shard in points]
+
+    def shard_for(self, user_id) -> int:
+        if self.shard_count == 1:
+            return 0
+        i = bisect.bisect(self._keys, _hash(f"user-{user_id}")) % len(self._keys)
+        return self._shards[i]
+
+
+ring = HashRing(len(SHARD_DATABASE_URLS))
+
+
+def shard_for_user(user_id, override=None) -> int:
+    if override is not None:
+        return int(override)
+    return ring.shard_for(user_id)
+
+
+def user_shard_key(user_id) -> str:
+    return f"shard:user:{user_id}"
+
+
+def cache_value(shard=None, moving_to=None) -> str:
+    # "<override>,<moving_to>", either part empty when unset ("," for most users)
+    return ",".join("" if value is None else str(value) for value in (shard, moving_to))
+
+
+def _from_cache(user_id, value):
+    override, moving_to = value.split(",")
+    return shard_for_user(user_id, override or None), bool(moving_to)
+
+
+async def get_user_shard(user_id):
+    """
+    Returns (override, moving_to) for a user from the directory database,
+    (None, None) for users routed by the ring alone.
+    """
+    async with resources.session_factory() as db:
+        row = (await db.execute(
+            select(UserShard.shard, UserShard.moving_to).where(UserShard.user_id == int(user_id))
+        )).first()
+    return tuple(row) if row else (None, None)
+
+
+async def store_user_shard(redis_client, user_id, shard=None, moving_to=None):
+    """
+    Writes a user's override and moving flag to the directory database, then
+    to the cache. Readers only fill the cache with SET NX, so a value read
+    from the table before this commit cannot replace the one written here.
+    """
+    async with resources.session_factory() as db:
+        if shard is None and moving_to is None:
+            await db.execute(delete(UserShard).where(UserShard.user_id == int(user_id)))
+        else:
+            await db.merge(UserShard(user_id=int(user_id), shard=shard, moving_to=moving_to))
+        await db.commit()
+    await redis_client.set(user_shard_key(user_id), cache_value(shard, moving_to), ex=SHARD_CACHE_TTL)
+
+
+async def resolve_shard(redis_client, user_id):
+    """
+    Returns (shard index, moving) for a user (async Redis client, used by the API).
+    """
+    if ring.shard_count == 1:
+        return 0, False
+    key = user_shard_key(user_id)
+    value = await redis_client.get(key)
+    if value is None:
+        value = cache_value(*await get_user_shard(user_id))
+        await redis_client.set(key, value, ex=SHARD_CACHE_TTL, nx=True)
+    return _from_cache(user_id, value)
+
+
+def resolve_shard_sync(redis_client, user_id):
+    """
+    Returns (shard index, moving) for a user (sync Redis client, used by Celery workers).
+    """
+    if ring.shard_count == 1:
+        return 0, False
+    key = user_shard_key(user_id)
+    value = redis_client.get(key)
+    if value is None:
+        value = cache_value(*run_async(get_user_shard(user_id)))
+        redis_client.set(key, value, ex=SHARD_CACHE_TTL, nx=True)
+    return _from_cache(user_id, value)
+
+
+def _sqlite_autoincrement(conn, table: str) -> bool:
+    # Only AUTOINCREMENT tables keep a counter (in sqlite_sequence); others continue after the largest id
+    return "AUTOINCREMENT" in conn.scalar(text(f"SELECT sql FROM sqlite_master WHERE name = '{table}'")).upper()
+
+
+def _last_id(conn, table: str) -> int:
+    # The id the table's counter handed out last (0 if none yet)
+    if conn.dialect.name == "postgresql":
+        sequence = conn.scalar(text(f"SELECT pg_get_serial_sequence('{table}', 'id')"))
+        return conn.scalar(text(f"SELECT CASE WHEN is_called THEN last_value ELSE 0 END FROM {sequence}"))
+    if not _sqlite_autoincrement(conn, table):
+        return conn.scalar(text(f"SELECT COALESCE(MAX(id), 0) FROM {table}"))
+    last = conn.scalar(text("SELECT seq FROM sqlite_sequence WHERE name = :table"), {"table": table})
+    return last or 0
+
+
+def _set_last_id(conn, table: str, value: int):
+    if conn.dialect.name == "postgresql":
+        conn.execute(text(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), {value})"))
+    elif not _sqlite_autoincrement(conn, table):
+        raise RuntimeError(f"SQLite table {table} was created without AUTOINCREMENT; recreate it")
+    elif not conn.execute(text("UPDATE sqlite_sequence SET seq = :value WHERE name = :table"),
+                          {"table": table, "value": value}).rowcount:
+        conn.execute(text("INSERT INTO sqlite_sequence (name, seq) VALUES (:table, :value)"),
+                     {"table": table, "value": value})
+
+
+def save_id_counters(conn) -> dict:
+    """
+    SQLite moves an AUTOINCREMENT counter up to any explicit id inserted, so
+    copying rows from a higher shard would push the counter into that shard's
+    range (see _allocate_sqlite_id). Returns the counters to put back with restore_id_counters() (run
+    both inside the copying transaction). Postgres sequences ignore explicit
+    ids, so there is nothing to save there.
+    """
+    if conn.dialect.name != "sqlite":
+        return {}
+    return {table: _last_id(conn, table) for table in ID_TABLES if _sqlite_autoincrement(conn, table)}
+
+
+def restore_id_counters(conn, counters: dict):
+    for table, value in counters.items():
+        _set_last_id(conn, table, value)
+
+
+@event.listens_for(Chatroom, "before_insert")
+@event.listens_for(Message, "before_insert")
+def _allocate_sqlite_id(mapper, conn, target):
+    # SQLite gives new rows max(counter, largest id) + 1, so rows moved in from
+    # a higher shard would pull new ids into that shard's range; on SQLite the
+    # ids come from the counter alone (Postgres sequences already work that way)
+    table = mapper.local_table.name
+    if conn.dialect.name != "sqlite" or target.id is not None or not _sqlite_autoincrement(conn, table):
+        return
+    target.id = _last_id(conn, table) + 1
+    _set_last_id(conn, table, target.id)
+
+
+def ensure_id_range(conn, shard: int):
+    """
+    Makes sure a shard hands out chatroom and message ids from its own range
+    (synchronous connection, e.g. `await conn.run_sync(ensure_id_range, shard)`).
+
+    Tables made by `create_all` start counting at 1 on every shard; while a
+    table is still empty its counter is moved to the start of the range. A
+    table that already has rows from a counter outside the range means ids
+    collide with another shard, and startup is refused.
+    """
+    if conn.dialect.name not in ("postgresql", "sqlite"):
+        raise RuntimeError(f"Shard id ranges are not supported on {conn.dialect.name}")
+    low, high = shard * ID_RANGE, (shard + 1) * ID_RANGE
+    for table in ID_TABLES:
+        last = _last_id(conn, table)
+        if low <= last < high:
+            continue
+        if conn.scalar(text(f"SELECT EXISTS (SELECT 1 FROM {table})")):
+            raise RuntimeError(
+                f"Shard {shard} hands out {table} ids after {last}, outside [{low}, {high}); "
+                f"ids may already collide with another shard"
+            )
+        # Sequences cannot be set to 0; shard 0 then starts at 2
+        _set_last_id(conn, table, max(low, 1))
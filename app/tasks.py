@@ -1,11 +1,247 @@
-from celery import Celery
+import json
+import logging
+import os
+import socket
+import time
 
-celery_app = Celery('worker', broker='redis://localhost:6379/0')
+from celery import Celery, signals
+from sqlalchemy.future import select
+
+from app.config import (
+    CELERY_BROKER_URL, GEMINI_HISTORY_MESSAGES, GEMINI_MAX_RETRIES,
+    USAGE_FLUSH_INTERVAL, USAGE_FLUSH_BATCH, RAG_ENABLED, RAG_TOP_K,
+)
+from app.crud import add_message
+from app.models import Chatroom, Message, User
+from app.queue.worker import run_async
+from app.resources import resources
+from app.schemas import MessageOut
+from app.utils.gemini import GeminiError, GeminiRejected, GeminiUnavailable
+from app.utils.metering import DIRTY_KEY, record_usage, collect_dirty_usage, upsert_usage, finish_flush
+from app.sharding import resolve_shard_sync
+from app.utils.pubsub import publish_event_sync
+from app.utils.etag import user_version_key, chatroom_version_key, bump_versions_sync
+from app.utils.vector_index import get_chatroom_index
+from app.utils.log import request_id_var, setup_logging
+
+logger = logging.getLogger(__name__)
+
+celery_app = Celery('worker', broker=CELERY_BROKER_URL)
+
+# Run with `celery -A app.tasks.celery_app beat` next to the workers
+celery_app.conf.beat_schedule = {
+    "flush-usage": {"task": "app.tasks.flush_usage_task", "schedule": USAGE_FLUSH_INTERVAL},
+}
+
+# Workers log through app.utils.log (Celery's own logging setup is skipped),
+# again per child process after a prefork fork
+@signals.setup_logging.connect
+@signals.worker_process_init.connect
+def configure_worker_logging(**kwargs):
+    setup_logging()
+
+# The request id of the API call that enqueued a task travels in its headers;
+# tasks enqueued without one log under their task id
+@signals.before_task_publish.connect
+def attach_request_id(headers=None, **kwargs):
+    request_id = request_id_var.get()
+    if request_id and headers is not None:
+        headers.setdefault("request_id", request_id)
+
+@signals.task_prerun.connect
+def bind_request_id(task_id=None, task=None, **kwargs):
+    request_id_var.set(getattr(task.request, "request_id", None) or task_id)
+
+@signals.task_postrun.connect
+def unbind_request_id(**kwargs):
+    request_id_var.set(None)
+
+METRICS_KEY = "metrics:gemini"  # one hash, field per worker process (host:pid)
+METRICS_TTL = 60  # seconds; a worker that stops reporting disappears from /metrics/gemini
+MOVING_RETRY_DELAY = 5  # seconds to wait while the user's rows move to another shard
+FALLBACK_REPLY = "Sorry, I couldn't generate a response for that message."
+
+async def _load_owner(chatroom_id):
+    # Tasks queued before user_id was passed along; only valid without sharding
+    async with resources.session_factory() as db:
+        result = await db.execute(select(Chatroom.user_id).where(Chatroom.id == chatroom_id))
+        return result.scalar_one()
+
+async def _load_tier(user_id):
+    # Users live in the directory database (shard 0)
+    async with resources.session_factory() as db:
+        result = await db.execute(select(User.subscription_tier).where(User.id == user_id))
+        return result.scalar_one_or_none() or "basic"
+
+async def _load_history(shard, chatroom_id):
+    async with resources.session_factories[shard]() as db:
+        result = await db.execute(
+            select(Message)
+            .where(Message.chatroom_id == chatroom_id)
+            .order_by(Message.created_at.desc(), Message.id.desc())
+            .limit(GEMINI_HISTORY_MESSAGES)
+        )
+        return list(reversed(result.scalars().all()))
+
+async def _save_reply(shard, chatroom_id, owner_id, text):
+    async with resources.session_factories[shard]() as db:
+        reply = await add_message(db, chatroom_id, owner_id, text, "ai")
+        await db.commit()
+        await db.refresh(reply)
+        return reply
+
+async def _load_messages(shard, message_ids):
+    async with resources.session_factories[shard]() as db:
+        result = await db.execute(select(Message).where(Message.id.in_(message_ids)))
+        by_id = {m.id: m for m in result.scalars().all()}
+        return [by_id[i] for i in message_ids if i in by_id]
+
+def _retrieve_context(shard, chatroom_id, content, exclude_ids):
+    """
+    Embeds the new message and finds relevant older turns outside the recent
+    history window. Returns (query_vector, system_instruction or None).
+    """
+    embedder = resources.embedder
+    query = embedder.embed([content])[0]
+    hits = get_chatroom_index(chatroom_id, embedder.dim).search(query, RAG_TOP_K, exclude_ids=exclude_ids)
+    if not hits:
+        return query, None
+    retrieved = run_async(_load_messages(shard, [message_id for message_id, _ in hits]))
+    lines = [f"- {m.role}: {m.content}" for m in sorted(retrieved, key=lambda m: m.id)]
+    return query, "Relevant earlier messages from this conversation:\n" + "\n".join(lines)
+
+def _index_messages(chatroom_id, query, message_id, content, reply):
+    # The user message reuses its query embedding if there is one; apologies are not indexed
+    embedder = resources.embedder
+    if query is None:
+        query = embedder.embed([content])[0]
+    ids, vectors = [message_id], [query]
+    if reply is not None and reply.content != FALLBACK_REPLY:
+        ids.append(reply.id)
+        vectors.append(embedder.embed([reply.content])[0])
+    get_chatroom_index(chatroom_id, embedder.dim).add(ids, vectors)
+
+def _publish_metrics(redis_client, client):
+    report = {**client.metrics(), "reported_at": time.time()}
+    redis_client.hset(METRICS_KEY, f"{socket.gethostname()}:{os.getpid()}", json.dumps(report))
+
+def _save_generated_reply(task, redis_client, chatroom_id, owner_id, text):
+    shard, moving = resolve_shard_sync(redis_client, owner_id)
+    if moving:
+        # Keep the reply instead of generating it again: the retry only saves
+        # it, and always has a retry left, so a long move cannot drop the reply
+        logger.info("User %s is moving shards; saving the reply to chatroom %s later", owner_id, chatroom_id)
+        raise task.retry(
+            kwargs={**task.request.kwargs, "reply_text": text},
+            countdown=MOVING_RETRY_DELAY, max_retries=task.request.retries + 1,
+        )
+    reply = run_async(_save_reply(shard, chatroom_id, owner_id, text))
+    bump_versions_sync(redis_client, chatroom_version_key(chatroom_id), user_version_key(owner_id))
+    publish_event_sync(redis_client, chatroom_id, {
+        "type": "message",
+        "message": MessageOut.model_validate(reply).model_dump(mode="json"),
+    })
+    return reply
+
+# Celery's retry count is not the budget: retries that never reached Gemini
+# are free, failed calls are counted in `gemini_failures` (GEMINI_MAX_RETRIES)
+@celery_app.task(bind=True, max_retries=None, acks_late=True)
+def gemini_task(self, chatroom_id, message_id, content, user_id=None, reply_text=None, gemini_failures=0):
+    redis_client = resources.sync_redis
+    client = resources.gemini
+    owner_id = user_id if user_id is not None else run_async(_load_owner(chatroom_id))
+    shard, moving = resolve_shard_sync(redis_client, owner_id)
+    if moving and reply_text is None:
+        # scripts/rebalance_user.py is copying this user's rows; try again once it is done
+        raise self.retry(countdown=MOVING_RETRY_DELAY)
+    publish_event_sync(redis_client, chatroom_id, {"type": "typing", "active": True})
+    try:
+        if reply_text is not None:
+            # Generated (and billed) by an earlier run; only the save is left
+            reply = _save_generated_reply(self, redis_client, chatroom_id, owner_id, reply_text)
+            if RAG_ENABLED:
+                try:
+                    _index_messages(chatroom_id, None, message_id, content, reply)
+                except Exception:
+                    logger.warning("Indexing failed for chatroom %s", chatroom_id, exc_info=True)
+            return reply.id
+        tier = run_async(_load_tier(owner_id))
+        history = run_async(_load_history(shard, chatroom_id))
+        contents = [
+            {"role": "model" if m.role == "ai" else "user", "parts": [{"text": m.content}]}
+            for m in history
+        ]
+        if not any(m.id == message_id for m in history):
+            contents.append({"role": "user", "parts": [{"text": content}]})
+
+        query = system_instruction = None
+        if RAG_ENABLED:
+            try:
+                query, system_instruction = _retrieve_context(
+                    shard, chatroom_id, content, exclude_ids={m.id for m in history} | {message_id}
+                )
+            except Exception:
+                logger.warning("Retrieval failed for chatroom %s; answering without it", chatroom_id, exc_info=True)
+
+        result = error = None
+        try:
+            result = client.generate(contents, system_instruction=system_instruction)
+        except GeminiRejected as exc:
+            # Breaker open or probing, or no free slot: Gemini was not called, so
+            # wait it out (at least the breaker's remaining reset time) for free
+            raise self.retry(exc=exc, countdown=exc.retry_after)
+        except GeminiUnavailable as exc:
+            if gemini_failures < GEMINI_MAX_RETRIES:
+                # Throttled or failing: come back later instead of piling on
+                raise self.retry(
+                    exc=exc, countdown=exc.retry_after,
+                    kwargs={**self.request.kwargs, "gemini_failures": gemini_failures + 1},
+                )
+            # Out of retries: answer anyway, so the client is not left on "typing"
+            error = {"type": "error", "status": 503, "detail": str(exc)}
+        except GeminiError as exc:
+            error = {"type": "error", "status": 502, "detail": str(exc)}
+
+        if result is None:
+            text = FALLBACK_REPLY
+            publish_event_sync(redis_client, chatroom_id, error)
+        else:
+            text = result.text
+            # Billed now, even if saving the reply has to wait for a shard move
+            record_usage(redis_client, owner_id, tier, result.prompt_tokens, result.completion_tokens)
+
+        reply = _save_generated_reply(self, redis_client, chatroom_id, owner_id, text)
+        if query is not None:
+            # Index after saving, so a retried task never indexes the same message twice
+            try:
+                _index_messages(chatroom_id, query, message_id, content, reply)
+            except Exception:
+                logger.warning("Indexing failed for chatroom %s", chatroom_id, exc_info=True)
+        return reply.id
+    finally:
+        publish_event_sync(redis_client, chatroom_id, {"type": "typing", "active": False})
+        _publish_metrics(redis_client, client)
+
+async def _upsert_usage(flushes, rows):
+    async with resources.session_factory() as db:
+        await upsert_usage(db, flushes, rows)
 
 @celery_app.task
-def gemini_task(chatroom_id, message_id, content):
-    # Call Gemini API here
-    # For example:
-    # response = call_gemini_api(content)
-    # Save response to database, etc.
-    pass
+def flush_usage_task():
+    """
+    Write-behind of Redis usage counters into the `usage` table (batched upsert).
+    """
+    redis_client = resources.sync_redis
+    flushed = 0
+    while True:
+        user_ids, flushes, rows = collect_dirty_usage(redis_client, USAGE_FLUSH_BATCH)
+        if not user_ids:
+            return flushed
+        try:
+            run_async(_upsert_usage(flushes, rows))
+        except Exception:
+            # Counters stay in their flushing hashes; the next flush picks them up
+            redis_client.sadd(DIRTY_KEY, *user_ids)
+            raise
+        finish_flush(redis_client, user_ids)
+        flushed += len(user_ids)
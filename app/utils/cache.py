@@ -1,17 +1,12 @@
 # app/utils/cache.py
 
-import os
 import json
-import redis.asyncio as aioredis
 
-# Redis connection URL (set this in your .env file for production)
-REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
 CACHE_TTL = 600  # 10 minutes in seconds
 
-# Create a single Redis client instance (reuse this in your app)
-redis_client = aioredis.from_url(REDIS_URL, decode_responses=True)
+# Callers pass the per-worker Redis client (the get_redis dependency, see app/dependencies.py)
 
-async def get_cached_chatrooms(user_id: str):
+async def get_cached_chatrooms(redis_client, user_id: str):
     """
     Get cached chatroom list for a user from Redis.
     Returns the Python object or None.
@@ -22,7 +17,7 @@ async def get_cached_chatrooms(user_id: str):
         return json.loads(data)
     return None
 
-async def set_cached_chatrooms(user_id: str, chatrooms):
+async def set_cached_chatrooms(redis_client, user_id: str, chatrooms):
     """
     Cache the chatroom list for a user in Redis.
     Pass chatrooms as a serializable Python object (e.g., list of dicts).
@@ -34,12 +29,12 @@ async def set_cached_chatrooms(user_id: str, chatrooms):
         await redis_client.set(key, json.dumps(chatrooms), ex=CACHE_TTL)
 
 # Example for rate limiting (optional, for your message endpoint)
-async def get_daily_message_count(user_id: str):
+async def get_daily_message_count(redis_client, user_id: str):
     key = f"daily_count:{user_id}"
     count = await redis_client.get(key)
     return int(count) if count else 0
 
-async def increment_daily_message_count(user_id: str):
+async def increment_daily_message_count(redis_client, user_id: str):
     key = f"daily_count:{user_id}"
     # Set expiry to midnight if not exists
     exists = await redis_client.exists(key)
@@ -0,0 +1,93 @@
+# app/utils/embeddings.py
+#
+# Pluggable text embedders for chatroom retrieval. Every embedder returns
+# L2-normalised float32 rows, so cosine similarity is a plain dot product.
+
+import hashlib
+import re
+from abc import ABC, abstractmethod
+
+import httpx
+import numpy as np
+
+from app.config import (
+    EMBEDDING_DIM, GEMINI_API_KEY, GEMINI_API_URL, GEMINI_EMBEDDING_MODEL, GEMINI_TIMEOUT,
+)
+
+TOKEN_RE = re.compile(r"\w+")
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class Embedder(ABC):
+    dim: int
+
+    @abstractmethod
+    def embed(self, texts: list) -> np.ndarray:
+        """
+        Returns an array of shape (len(texts), dim), float32, L2-normalised.
+        """
+
+    def close(self):
+        pass
+
+
+class HashingEmbedder(Embedder):
+    """
+    Local embedder (feature hashing of words and word bigrams). No network or
+    model files; good enough for keyword-level recall and for tests.
+    """
+
+    def __init__(self, dim: int = EMBEDDING_DIM):
+        self.dim = dim
+
+    def _features(self, text: str):
+        words = TOKEN_RE.findall(text.lower())
+        return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+    def embed(self, texts: list) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                digest = hashlib.blake2b(feature.encode(), digest_size=8).digest()
+                value = int.from_bytes(digest, "little")
+                sign = 1.0 if value & 1 else -1.0
+                vectors[row, (value >> 1) % self.dim] += sign
+        return normalize(vectors)
+
+
+class GeminiEmbedder(Embedder):
+    """
+    Gemini embedding API (batchEmbedContents), truncated to `dim` dimensions.
+    """
+
+    def __init__(self, dim: int = EMBEDDING_DIM, api_url=GEMINI_API_URL, api_key=GEMINI_API_KEY,
+                 model=GEMINI_EMBEDDING_MODEL):
+        self.dim = dim
+        self.model = f"models/{model}"
+        self.url = f"{api_url.rstrip('/')}/{self.model}:batchEmbedContents"
+        self.api_key = api_key
+        self.http = httpx.Client(timeout=GEMINI_TIMEOUT)
+
+    def embed(self, texts: list) -> np.ndarray:
+        response = self.http.post(
+            self.url,
+            params={"key": self.api_key},
+            json={"requests": [
+                {"model": self.model, "content": {"parts": [{"text": text}]}, "outputDimensionality": self.dim}
+                for text in texts
+            ]},
+        )
+        response.raise_for_status()
+        return normalize([item["values"] for item in response.json()["embeddings"]])
+
+    def close(self):
+        self.http.close()
+
+
+EMBEDDERS = {"hash": HashingEmbedder, "gemini": GeminiEmbedder}
@@ -0,0 +1,88 @@
+# app/utils/etag.py
+#
+# Cheap ETags for chatroom and message reads, derived from version counters in
+# Redis instead of hashing the response body. Writes bump the counters after
+# they commit; reads fetch the counter *before* querying, so an ETag can be
+# older than the data it is sent with (costing one extra full response later)
+# but never newer. Only writes create counters: a read of something that was
+# never written (or whose counter was lost) is sent without an ETag.
+
+import time
+
+from fastapi import Request, Response
+
+CACHE_CONTROL = "private, no-cache"  # clients may keep the body but must revalidate
+
+
+def user_version_key(user_id) -> str:
+    # Chatroom list of a user (names, summaries, ordering)
+    return f"ver:user:{user_id}"
+
+
+def chatroom_version_key(chatroom_id) -> str:
+    # One chatroom and its messages
+    return f"ver:chatroom:{chatroom_id}"
+
+
+def _seed() -> int:
+    # Counters start from the clock, so a counter lost from Redis never
+    # restarts at a value an old ETag could match
+    return time.time_ns()
+
+
+async def current_etag(redis_client, key: str, *parts):
+    """
+    Returns the ETag for `parts` at the version counter `key`, or None if no
+    write has created the counter yet.
+    """
+    version = await redis_client.get(key)
+    if version is None:
+        return None
+    return make_etag(*parts, version)
+
+
+async def bump_versions(redis_client, *keys):
+    """
+    Invalidates ETags after a write (async Redis client, used by the API).
+    """
+    pipe = redis_client.pipeline(transaction=False)
+    for key in keys:
+        pipe.set(key, _seed(), nx=True)
+        pipe.incr(key)
+    await pipe.execute()
+
+
+def bump_versions_sync(redis_client, *keys):
+    """
+    Invalidates ETags after a write (sync Redis client, used by Celery workers).
+    """
+    pipe = redis_client.pipeline(transaction=False)
+    for key in keys:
+        pipe.set(key, _seed(), nx=True)
+        pipe.incr(key)
+    pipe.execute()
+
+
+def make_etag(*parts) -> str:
+    return 'W/"' + "-".join(str(part) for part in parts) + '"'
+
+
+def not_modified(request: Request, etag: str):
+    """
+    Returns a 304 response if the client's If-None-Match matches `etag`, else None.
+    """
+    header = request.headers.get("if-none-match")
+    if not header or etag is None:
+        return None
+    # Weak comparison: ignore W/ prefixes
+    candidates = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    if etag.removeprefix("W/") in candidates:
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": CACHE_CONTROL})
+    return None
+
+
+def set_etag(response: Response, etag: str):
+    if etag is None:
+        return
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CACHE_CONTROL
@@ -0,0 +1,275 @@
+# app/utils/gemini.py
+
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import httpx
+
+from app.config import (
+    GEMINI_API_KEY, GEMINI_API_URL, GEMINI_MODEL, GEMINI_TIMEOUT,
+    GEMINI_MIN_CONCURRENCY, GEMINI_MAX_CONCURRENCY, GEMINI_INITIAL_CONCURRENCY,
+    GEMINI_LATENCY_TARGET, GEMINI_BREAKER_THRESHOLD, GEMINI_BREAKER_RESET,
+)
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class GeminiError(Exception):
+    """Non-retryable Gemini failure (bad request, auth, malformed response)."""
+
+
+class GeminiUnavailable(Exception):
+    """Gemini is throttling, failing or the breaker is open; retry after `retry_after` seconds."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class GeminiRejected(GeminiUnavailable):
+    """Refused here without calling Gemini (breaker open, probe running, no concurrency slot)."""
+
+
+@dataclass
+class GeminiResult:
+    text: str
+    prompt_tokens: int
+    completion_tokens: int
+
+
+class AIMDLimiter:
+    """
+    Adaptive concurrency limit (additive increase, multiplicative decrease).
+
+    Every call that finishes under the latency target without a congestion
+    signal grows the limit by 1/limit (about +1 per "round" of calls); a
+    retryable failure (429, 5xx, transport error) or a slow call halves it.
+    Like TCP, it halves at most once per round: only calls started after the
+    last decrease count, since the others were sent under the old limit and
+    one burst of their failures would otherwise collapse the limit.
+    """
+
+    def __init__(self, initial=GEMINI_INITIAL_CONCURRENCY, minimum=GEMINI_MIN_CONCURRENCY,
+                 maximum=GEMINI_MAX_CONCURRENCY, latency_target=GEMINI_LATENCY_TARGET):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_target = latency_target
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            self.in_flight += 1
+            return True
+
+    def cancel(self):
+        # Give the slot back without counting it as a completed call
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+
+    def release(self, started: float, congested: bool):
+        with self._cond:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if congested or now - started > self.latency_target:
+                if started >= self._last_decrease:
+                    self.limit = max(self.minimum, self.limit / 2)
+                    self._last_decrease = now
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+
+class CircuitBreaker:
+    """
+    closed -> open after `threshold` consecutive failures; open -> half_open
+    after the reset timeout (or the server's Retry-After, if the last failure
+    sent one), when a single probe call is let through; the probe's outcome
+    closes or re-opens it. A lone 429 is left to the AIMD limiter.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, threshold=GEMINI_BREAKER_THRESHOLD, reset_timeout=GEMINI_BREAKER_RESET,
+                 probe_wait=2.0):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        # Calls refused while the probe runs come back this soon (retrying them is free)
+        self.probe_wait = probe_wait
+        self.state = self.CLOSED
+        self.failures = 0
+        self.open_until = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            remaining = self.open_until - time.monotonic()
+            if self.state == self.OPEN and remaining > 0:
+                raise GeminiRejected("Gemini circuit breaker is open", retry_after=remaining)
+            # Reset timeout elapsed: allow exactly one probe
+            if self._probing:
+                raise GeminiRejected("Gemini circuit breaker probe in progress", retry_after=self.probe_wait)
+            self.state = self.HALF_OPEN
+            self._probing = True
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self, retry_after: float = None):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+                self.state = self.OPEN
+                # The server's Retry-After wins over our own reset timeout
+                wait = retry_after if retry_after is not None else self.reset_timeout
+                self.open_until = time.monotonic() + wait
+
+    def retry_after(self) -> float:
+        return max(0.0, self.open_until - time.monotonic())
+
+
+def parse_retry_after(value: str):
+    """
+    Retry-After is either delay-seconds or an HTTP date; returns seconds or None.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+class GeminiClient:
+    """
+    Thread-safe Gemini client shared by the tasks of one worker process.
+    """
+
+    def __init__(self, api_url=GEMINI_API_URL, api_key=GEMINI_API_KEY, model=GEMINI_MODEL,
+                 timeout=GEMINI_TIMEOUT):
+        self.url = f"{api_url.rstrip('/')}/models/{model}:generateContent"
+        self.api_key = api_key
+        self.timeout = timeout
+        self.http = httpx.Client(timeout=timeout)
+        self.limiter = AIMDLimiter()
+        self.breaker = CircuitBreaker()
+        self.calls = 0
+        self.throttled = 0
+        self.failures = 0
+
+    def generate(self, contents: list, system_instruction: str = None) -> GeminiResult:
+        """
+        `contents` uses the Gemini format: [{"role": "user"|"model", "parts": [{"text": ...}]}].
+        """
+        payload = {"contents": contents}
+        if system_instruction:
+            payload["systemInstruction"] = {"parts": [{"text": system_instruction}]}
+        if not self.limiter.acquire(timeout=self.timeout):
+            raise GeminiRejected("Gemini concurrency limit reached", retry_after=1.0)
+        try:
+            self.breaker.before_call()
+        except GeminiRejected:
+            self.limiter.cancel()
+            raise
+
+        started = time.monotonic()
+        # Fast failures count as congestion too, so the limit never grows while Gemini is failing
+        congested = False
+        try:
+            self.calls += 1
+            try:
+                response = self.http.post(
+                    self.url, params={"key": self.api_key}, json=payload
+                )
+            except httpx.TransportError as exc:
+                congested = True
+                self.failures += 1
+                self.breaker.record_failure()
+                raise GeminiUnavailable(f"Gemini request failed: {exc}", retry_after=self._backoff())
+            except Exception:
+                # Decoding errors, redirect loops, bugs: still a failed call, and
+                # a half-open probe must not stay "in progress" forever
+                congested = True
+                self.failures += 1
+                self.breaker.record_failure()
+                raise
+
+            if response.status_code in RETRYABLE_STATUS:
+                congested = True
+                self.throttled += response.status_code == 429
+                self.failures += 1
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                self.breaker.record_failure(retry_after)
+                raise GeminiUnavailable(
+                    f"Gemini returned {response.status_code}",
+                    retry_after=retry_after if retry_after is not None else self._backoff(),
+                )
+            if response.status_code >= 400:
+                self.breaker.record_success()  # the service is up; the request is wrong
+                raise GeminiError(f"Gemini returned {response.status_code}: {response.text[:200]}")
+
+            try:
+                data = response.json()
+            except ValueError:
+                self.failures += 1
+                self.breaker.record_failure()
+                raise GeminiError(f"Gemini returned a malformed body: {response.text[:200]}")
+            self.breaker.record_success()
+            return _parse_response(data)
+        finally:
+            self.limiter.release(started, congested)
+
+    def metrics(self) -> dict:
+        return {
+            "concurrency_limit": round(self.limiter.limit, 2),
+            "in_flight": self.limiter.in_flight,
+            "breaker_state": self.breaker.state,
+            "breaker_retry_after": round(self.breaker.retry_after(), 1),
+            "calls": self.calls,
+            "throttled": self.throttled,
+            "failures": self.failures,
+        }
+
+    def close(self):
+        self.http.close()
+
+    def _backoff(self) -> float:
+        return max(1.0, self.breaker.retry_after())
+
+
+def _parse_response(data: dict) -> GeminiResult:
+    try:
+        parts = data["candidates"][0]["content"]["parts"]
+    except (KeyError, IndexError, TypeError):
+        raise GeminiError("Gemini response has no candidates")
+    usage = data.get("usageMetadata", {})
+    return GeminiResult(
+        text="".join(part.get("text", "") for part in parts),
+        prompt_tokens=usage.get("promptTokenCount", 0),
+        completion_tokens=usage.get("candidatesTokenCount", 0),
+    )
+
@@ -0,0 +1,113 @@
+# app/utils/idempotency.py
+#
+# Idempotency-Key support: the first request with a key claims it in Redis,
+# does the work and stores its response; replays get the stored response and
+# concurrent duplicates wait for the first one to finish. Work with a
+# follow-up step (a message and the task that answers it) is stored as SAVED
+# in between, so a retry finishes the follow-up instead of redoing the work.
+
+import asyncio
+import hashlib
+import json
+import time
+
+from fastapi import HTTPException, status
+
+from app.config import IDEMPOTENCY_TTL, IDEMPOTENCY_LOCK_TTL, IDEMPOTENCY_WAIT_TIMEOUT
+
+PENDING = "pending"
+SAVED = "saved"
+DONE = "done"
+
+
+def _key(scope: str, idempotency_key: str) -> str:
+    return f"idem:{scope}:{idempotency_key}"
+
+
+def _follow_up_key(scope: str, idempotency_key: str) -> str:
+    # Held by whoever is running the follow-up of a SAVED entry
+    return f"idem:{scope}:{idempotency_key}:follow-up"
+
+
+def fingerprint(*parts) -> str:
+    """
+    Hash of the request payload, so a key reused for a different request is rejected.
+    """
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+async def claim(redis_client, scope: str, idempotency_key: str, request_fingerprint: str):
+    """
+    Returns None if the caller now owns the key and must do the work (then call
+    `complete` or `release`, or `mark_saved` first), else the stored entry:
+    DONE holds the response to replay; SAVED means an earlier request did the
+    work but not its follow-up, which the caller now owns (then call
+    `complete` or `unlock`).
+    """
+    key = _key(scope, idempotency_key)
+    pending = json.dumps({"state": PENDING, "fingerprint": request_fingerprint})
+    deadline = time.monotonic() + IDEMPOTENCY_WAIT_TIMEOUT
+    delay = 0.05
+    while True:
+        if await redis_client.set(key, pending, nx=True, ex=IDEMPOTENCY_LOCK_TTL):
+            return None
+        raw = await redis_client.get(key)
+        if raw is None:
+            continue  # the owner gave up between our SET and GET; try to claim again
+        entry = json.loads(raw)
+        if entry["fingerprint"] != request_fingerprint:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail="Idempotency-Key was already used with a different request"
+            )
+        if entry["state"] == DONE:
+            return entry
+        if entry["state"] == SAVED and await redis_client.set(
+            _follow_up_key(scope, idempotency_key), 1, nx=True, ex=IDEMPOTENCY_LOCK_TTL
+        ):
+            return entry
+        # Same request still in flight elsewhere: wait for its result
+        if time.monotonic() >= deadline:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="A request with this Idempotency-Key is still in progress"
+            )
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 0.5)
+
+
+async def mark_saved(redis_client, scope: str, idempotency_key: str, request_fingerprint: str, response):
+    """
+    Stores the response once the work is saved, before its follow-up runs.
+    The caller keeps the key for the follow-up (then `complete` or `unlock`).
+    """
+    entry = {"state": SAVED, "fingerprint": request_fingerprint, "response": response}
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.set(_follow_up_key(scope, idempotency_key), 1, ex=IDEMPOTENCY_LOCK_TTL)
+    pipe.set(_key(scope, idempotency_key), json.dumps(entry, default=str), ex=IDEMPOTENCY_TTL)
+    await pipe.execute()
+
+
+async def complete(redis_client, scope: str, idempotency_key: str, request_fingerprint: str, response):
+    """
+    Stores the response for replays.
+    """
+    entry = {"state": DONE, "fingerprint": request_fingerprint, "response": response}
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.set(_key(scope, idempotency_key), json.dumps(entry, default=str), ex=IDEMPOTENCY_TTL)
+    pipe.delete(_follow_up_key(scope, idempotency_key))
+    await pipe.execute()
+
+
+async def release(redis_client, scope: str, idempotency_key: str):
+    """
+    Drops a claim after a failed request so the client's retry can run it.
+    """
+    await redis_client.delete(_key(scope, idempotency_key))
+
+
+async def unlock(redis_client, scope: str, idempotency_key: str):
+    """
+    Gives up the follow-up of a SAVED entry after it failed, so a retry can run it.
+    """
+    await redis_client.delete(_follow_up_key(scope, idempotency_key))
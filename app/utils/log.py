@@ -0,0 +1,202 @@
+# app/utils/log.py
+#
+# Non-blocking structured logging. Loggers hand records to a bounded queue
+# (QueueHandler) and one background thread per process formats and writes
+# them, so a slow stdout/pipe costs the event loop nothing; when the queue is
+# full, records are dropped and the count is reported later instead of
+# blocking. Every record carries the current request id (set by the HTTP
+# middleware, and by the Celery task signals from the message headers).
+#
+# SQL statements and DEBUG records are sampled by request id: a request is
+# either logged completely or not at all, which keeps sampled logs readable.
+
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import re
+import sys
+import uuid
+import zlib
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from app.config import LOG_LEVEL, LOG_FORMAT, LOG_QUEUE_SIZE, LOG_SQL_SAMPLE_RATE, LOG_DEBUG_SAMPLE_RATE
+
+request_id_var: ContextVar = ContextVar("request_id", default=None)
+
+REQUEST_ID_RE = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s"
+
+# Attributes every LogRecord has; anything else came from `extra=` and is logged as a field
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "request_id"}
+
+
+def new_request_id(header_value=None) -> str:
+    """
+    Returns the client's X-Request-ID if it looks sane, else a fresh id.
+    """
+    if header_value and REQUEST_ID_RE.match(header_value):
+        return header_value
+    return uuid.uuid4().hex
+
+
+def _sampled(rate: float, key) -> bool:
+    if rate >= 1:
+        return True
+    if rate <= 0:
+        return False
+    if key is None:
+        return random.random() < rate
+    return zlib.crc32(key.encode()) / 2 ** 32 < rate
+
+
+class RequestIdFilter(logging.Filter):
+    # Attached before the queue, i.e. in the thread (and context) that logged
+    def filter(self, record):
+        if not hasattr(record, "request_id"):
+            record.request_id = request_id_var.get() or "-"
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, sql_rate: float, debug_rate: float):
+        super().__init__()
+        self.sql_rate = sql_rate
+        self.debug_rate = debug_rate
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        if record.name.startswith("sqlalchemy.engine"):
+            return _sampled(self.sql_rate, request_id_var.get())
+        if record.levelno <= logging.DEBUG:
+            return _sampled(self.debug_rate, request_id_var.get())
+        return True
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    QueueHandler that never blocks: records that do not fit are counted and dropped.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Keep the message and traceback as separate fields for the formatter,
+        # but resolve them here: args and tracebacks may not outlive the caller
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class DropReportingListener(QueueListener):
+    def __init__(self, log_queue, queue_handler, *handlers):
+        super().__init__(log_queue, *handlers, respect_handler_level=True)
+        self.queue_handler = queue_handler
+        self._reported = 0
+
+    def handle(self, record):
+        dropped = self.queue_handler.dropped
+        if dropped != self._reported:
+            warning = logging.makeLogRecord({
+                "name": __name__, "levelno": logging.WARNING, "levelname": "WARNING",
+                "msg": f"Dropped {dropped - self._reported} log record(s), queue full",
+                "request_id": "-",
+            })
+            self._reported = dropped
+            super().handle(warning)
+        super().handle(record)
+
+    def enqueue_sentinel(self):
+        # Shutdown may wait for room in a full queue (the default does not)
+        self.queue.put(self._sentinel)
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", "-"),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        if record.stack_info:
+            entry["stack"] = record.stack_info
+        return json.dumps(entry, default=str)
+
+
+_listener = None
+_pid = None
+
+def setup_logging(**kwargs):
+    """
+    Routes all logging in this process through the queue. Safe to call more
+    than once; after a fork it starts a new listener thread for the child.
+    """
+    global _listener, _pid
+    if _listener is not None and _pid == os.getpid():
+        return
+
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    queue_handler = DroppingQueueHandler(log_queue)
+    queue_handler.addFilter(RequestIdFilter())
+    queue_handler.addFilter(SamplingFilter(LOG_SQL_SAMPLE_RATE, LOG_DEBUG_SAMPLE_RATE))
+
+    sink = logging.StreamHandler(sys.stdout)
+    sink.addFilter(RequestIdFilter())
+    sink.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter(TEXT_FORMAT))
+
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(LOG_LEVEL)
+    # Server and worker loggers go through the root handler too
+    for name in ("uvicorn", "uvicorn.error", "gunicorn.error", "celery"):
+        logger = logging.getLogger(name)
+        logger.handlers.clear()
+        logger.propagate = True
+    # Replaced by the app.access record, which has the request id and duration
+    logging.getLogger("uvicorn.access").disabled = True
+    # SQLAlchemy skips building SQL log records entirely below INFO
+    logging.getLogger("sqlalchemy.engine").setLevel(logging.INFO if LOG_SQL_SAMPLE_RATE > 0 else logging.WARNING)
+
+    if _listener is None:
+        atexit.register(shutdown_logging)
+    _listener = DropReportingListener(log_queue, queue_handler, sink)
+    _listener.start()
+    _pid = os.getpid()
+
+
+def shutdown_logging():
+    """
+    Writes out queued records and stops the listener thread. Records logged
+    afterwards (server shutdown messages) are written directly.
+    """
+    global _listener
+    if _listener is None or _pid != os.getpid():
+        return
+    logging.getLogger().handlers[:] = list(_listener.handlers)
+    _listener.stop()
+    _listener = None
@@ -0,0 +1,208 @@
+# app/utils/metering.py
+#
+# Per-user token usage metering with write-behind to Postgres.
+#
+# Each Gemini call does a constant number of HINCRBYs on one Redis hash per
+# user (fields "<day>|<tier>|<metric>") and marks the user dirty. A periodic
+# Celery task moves dirty hashes aside atomically and upserts them into the
+# `usage` table in one batched statement, so Postgres sees one write per
+# user/tier/day per flush interval no matter how many calls were made.
+#
+# Every moved-aside ("flushing") hash gets a generation number, and the
+# upsert records the last applied generation per user (`usage_flushes`) in
+# the same transaction. A flush that is re-run after dying between commit
+# and cleanup is skipped, and readers ignore a flushing hash that Postgres
+# already contains. Generations are seeded from the clock, so they keep
+# growing past the stored ones even if Redis loses the counter.
+
+import time
+from collections import defaultdict
+from datetime import date, datetime
+
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import Usage, UsageFlush
+
+DIRTY_KEY = "usage:dirty"
+GENERATION_KEY = "usage:generation"
+GENERATION_FIELD = "generation"  # in flushing hashes; counter fields always contain "|"
+METRICS = ("prompt", "completion", "calls")
+
+# Move the live hash aside as the "flushing" hash with a new generation,
+# atomically, so calls recorded during a flush land in a fresh hash. A
+# flushing hash left by a flush that died is returned unchanged (it may
+# already be in Postgres, so nothing may be merged into it); the user stays
+# dirty until the live counters get their own turn.
+MOVE_SCRIPT = """
+if redis.call('EXISTS', KEYS[2]) == 1 then
+    if redis.call('EXISTS', KEYS[1]) == 1 then
+        redis.call('SADD', KEYS[4], ARGV[1])
+    end
+elseif redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('SET', KEYS[3], ARGV[3], 'NX')
+    redis.call('RENAME', KEYS[1], KEYS[2])
+    redis.call('INCR', KEYS[3])
+    -- GET, not INCR's reply: Lua numbers are doubles and would round the generation
+    redis.call('HSET', KEYS[2], ARGV[2], redis.call('GET', KEYS[3]))
+end
+return redis.call('HGETALL', KEYS[2])
+"""
+
+
+def _seed() -> int:
+    # Clock-based start for the generation counter (nanoseconds fit in BIGINT):
+    # a counter lost from Redis restarts above every generation already applied
+    return time.time_ns()
+
+
+def live_key(user_id) -> str:
+    return f"usage:{user_id}"
+
+
+def flushing_key(user_id) -> str:
+    return f"usage:flushing:{user_id}"
+
+
+def record_usage(redis_client, user_id: int, tier: str, prompt_tokens: int, completion_tokens: int, day: date = None):
+    """
+    Counts one Gemini call (sync Redis client, used by Celery workers). O(1).
+    """
+    prefix = f"{(day or datetime.utcnow().date()).isoformat()}|{tier}|"
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.hincrby(live_key(user_id), prefix + "prompt", prompt_tokens)
+    pipe.hincrby(live_key(user_id), prefix + "completion", completion_tokens)
+    pipe.hincrby(live_key(user_id), prefix + "calls", 1)
+    pipe.sadd(DIRTY_KEY, user_id)
+    pipe.execute()
+
+
+def parse_usage_hash(mapping: dict) -> dict:
+    """
+    {"2025-07-11|basic|prompt": "12", ...} -> {(date, tier): {"prompt": 12, ...}}
+    """
+    totals = defaultdict(lambda: dict.fromkeys(METRICS, 0))
+    for field, value in mapping.items():
+        if field == GENERATION_FIELD:
+            continue
+        day, tier, metric = field.rsplit("|", 2)
+        totals[(date.fromisoformat(day), tier)][metric] += int(value)
+    return totals
+
+
+def collect_dirty_usage(redis_client, batch: int):
+    """
+    Moves up to `batch` dirty users' counters aside (sync Redis client).
+    Returns (user_ids, flushes, rows) ready for upsert_usage(), where flushes
+    are the {"user_id", "generation"} pairs of the moved hashes.
+    """
+    user_ids = redis_client.spop(DIRTY_KEY, batch) or []
+    move = redis_client.register_script(MOVE_SCRIPT)
+    flushes, rows = [], []
+    for user_id in user_ids:
+        values = move(
+            keys=[live_key(user_id), flushing_key(user_id), GENERATION_KEY, DIRTY_KEY],
+            args=[user_id, GENERATION_FIELD, _seed()],
+        )
+        mapping = dict(zip(values[::2], values[1::2]))
+        if GENERATION_FIELD not in mapping:
+            continue
+        flushes.append({"user_id": int(user_id), "generation": int(mapping[GENERATION_FIELD])})
+        for (day, tier), counts in parse_usage_hash(mapping).items():
+            rows.append({
+                "user_id": int(user_id),
+                "tier": tier,
+                "day": day,
+                "prompt_tokens": counts["prompt"],
+                "completion_tokens": counts["completion"],
+                "calls": counts["calls"],
+            })
+    return user_ids, flushes, rows
+
+
+def finish_flush(redis_client, user_ids):
+    """
+    Drops the flushed counters once the upsert has committed.
+    """
+    if user_ids:
+        redis_client.delete(*[flushing_key(user_id) for user_id in user_ids])
+
+
+async def upsert_usage(db: AsyncSession, flushes: list, rows: list):
+    """
+    Adds the counters to `usage` in one INSERT ... ON CONFLICT DO UPDATE,
+    skipping users whose flush generation was already applied.
+    """
+    if not flushes:
+        return
+    dialect = postgresql if db.bind.dialect.name == "postgresql" else sqlite
+    # Claim the generations first: the conditional update locks each user's
+    # row, so a concurrent or repeated flush of the same hash claims nothing
+    claim = dialect.insert(UsageFlush).values(flushes)
+    claim = claim.on_conflict_do_update(
+        index_elements=["user_id"],
+        set_={"generation": claim.excluded.generation},
+        where=UsageFlush.generation < claim.excluded.generation,
+    ).returning(UsageFlush.user_id)
+    claimed = set((await db.execute(claim)).scalars().all())
+    rows = [row for row in rows if row["user_id"] in claimed]
+    if not rows:
+        await db.commit()
+        return
+    stmt = dialect.insert(Usage).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["user_id", "tier", "day"],
+        set_={
+            "prompt_tokens": Usage.prompt_tokens + stmt.excluded.prompt_tokens,
+            "completion_tokens": Usage.completion_tokens + stmt.excluded.completion_tokens,
+            "calls": Usage.calls + stmt.excluded.calls,
+        },
+    )
+    await db.execute(stmt)
+    await db.commit()
+
+
+async def read_hot_usage(redis_client, user_id):
+    """
+    Counters still in Redis, async Redis client. Returns (live totals, flushing
+    totals, flushing generation or None, generation counter); see merge_hot_usage().
+
+    Read these *before* the `usage` rows. A flush that commits in between is
+    then visible in Postgres with a generation above the counter read here:
+    the flushing copy is ignored, and the live copy may have been moved, so
+    the caller must read again (hot_usage_is_stale()).
+    """
+    # The counter must exist, so a move after this read shows up as a newer generation
+    await redis_client.set(GENERATION_KEY, _seed(), nx=True)
+    # MULTI, so a concurrent move cannot put the same counts in both reads
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.hgetall(live_key(user_id))
+    pipe.hgetall(flushing_key(user_id))
+    pipe.get(GENERATION_KEY)
+    live, flushing, counter = await pipe.execute()
+    generation = flushing.get(GENERATION_FIELD)
+    return (
+        parse_usage_hash(live), parse_usage_hash(flushing),
+        int(generation) if generation else None, int(counter or 0),
+    )
+
+
+def hot_usage_is_stale(hot, applied_generation) -> bool:
+    """
+    True if Postgres applied a flush that moved counters after `hot` was read.
+    """
+    return (applied_generation or 0) > hot[3]
+
+
+def merge_hot_usage(hot, applied_generation) -> dict:
+    """
+    Live counters plus the flushing ones, unless Postgres already has them.
+    Only valid for a snapshot that is not stale (hot_usage_is_stale()).
+    """
+    live, flushing, generation, _ = hot
+    totals = live
+    if generation is not None and generation > (applied_generation or 0):
+        for key, counts in flushing.items():
+            for metric in METRICS:
+                totals[key][metric] += counts[metric]
+    return totals
@@ -0,0 +1,45 @@
+# app/utils/passwords.py
+#
+# argon2 hashing costs tens of milliseconds of CPU per call, so it never runs
+# on the event loop: hashes and verifications go to a bounded thread pool
+# (argon2-cffi releases the GIL while hashing, so threads run in parallel).
+
+import asyncio
+
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
+
+from app.config import PASSWORD_HASH_TIME_COST, PASSWORD_HASH_MEMORY_COST, PASSWORD_HASH_PARALLELISM
+from app.resources import resources
+
+hasher = PasswordHasher(
+    time_cost=PASSWORD_HASH_TIME_COST,
+    memory_cost=PASSWORD_HASH_MEMORY_COST,
+    parallelism=PASSWORD_HASH_PARALLELISM,
+)
+
+def _verify(password_hash: str, password: str, rehash: bool):
+    try:
+        hasher.verify(password_hash, password)
+    except (VerificationError, InvalidHashError):
+        return False, None
+    if rehash and hasher.check_needs_rehash(password_hash):
+        return True, hasher.hash(password)
+    return True, None
+
+async def hash_password(password: str) -> str:
+    """
+    Returns an argon2id hash of the password (computed off the event loop).
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(resources.password_executor, hasher.hash, password)
+
+async def verify_password(password_hash: str, password: str, rehash: bool = True):
+    """
+    Checks a password against its stored hash (off the event loop).
+    Returns (valid, new_hash); new_hash is set when the stored hash used older
+    cost parameters and should be saved in its place. Callers about to store a
+    new hash anyway pass rehash=False to skip computing it.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(resources.password_executor, _verify, password_hash, password, rehash)
@@ -0,0 +1,128 @@
+# app/utils/pubsub.py
+
+import asyncio
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Events that can be dropped for a slow client without losing conversation state
+DROPPABLE_EVENTS = {"typing"}
+
+
+def chatroom_channel(chatroom_id) -> str:
+    return f"chatroom:{chatroom_id}:events"
+
+
+async def publish_event(redis_client, chatroom_id, event: dict):
+    """
+    Publish a chatroom event (async Redis client, used by the API).
+    """
+    await redis_client.publish(chatroom_channel(chatroom_id), json.dumps(event, default=str))
+
+
+def publish_event_sync(redis_client, chatroom_id, event: dict):
+    """
+    Publish a chatroom event (sync Redis client, used by Celery workers).
+    """
+    redis_client.publish(chatroom_channel(chatroom_id), json.dumps(event, default=str))
+
+
+class Subscription:
+    """
+    Bounded per-socket buffer between the hub and a WebSocket sender.
+
+    A `None` in the queue means the client fell too far behind and must be
+    disconnected (it can reconnect and reload history over REST).
+    """
+
+    def __init__(self, chatroom_id: int, maxsize: int):
+        self.chatroom_id = chatroom_id
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.overflowed = False
+
+    def offer(self, event: dict):
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            if event.get("type") in DROPPABLE_EVENTS:
+                return
+            self.overflowed = True
+            # Make room for the disconnect marker
+            self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+    async def get(self):
+        return await self.queue.get()
+
+
+class ChatroomHub:
+    """
+    Process-wide fan-out of chatroom events.
+
+    One Redis pub/sub connection per worker process, subscribed only to the
+    chatrooms that have a local socket; each message is copied into the
+    bounded queue of every local subscriber.
+    """
+
+    def __init__(self, redis_client, queue_size: int = 100):
+        self.redis = redis_client
+        self.queue_size = queue_size
+        self.pubsub = None
+        self.subscribers: dict[int, set[Subscription]] = {}
+        self._reader = None
+
+    async def start(self):
+        self.pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        self._reader = asyncio.create_task(self._read_loop())
+
+    async def stop(self):
+        if self._reader is not None:
+            self._reader.cancel()
+            try:
+                await self._reader
+            except asyncio.CancelledError:
+                pass
+        if self.pubsub is not None:
+            await self.pubsub.aclose()
+        self.subscribers.clear()
+
+    async def subscribe(self, chatroom_id: int) -> Subscription:
+        subscription = Subscription(chatroom_id, self.queue_size)
+        subscribers = self.subscribers.setdefault(chatroom_id, set())
+        first = not subscribers
+        subscribers.add(subscription)
+        if first:
+            await self.pubsub.subscribe(chatroom_channel(chatroom_id))
+        return subscription
+
+    async def unsubscribe(self, subscription: Subscription):
+        subscribers = self.subscribers.get(subscription.chatroom_id)
+        if not subscribers:
+            return
+        subscribers.discard(subscription)
+        if not subscribers:
+            del self.subscribers[subscription.chatroom_id]
+            await self.pubsub.unsubscribe(chatroom_channel(subscription.chatroom_id))
+
+    async def _read_loop(self):
+        while True:
+            if not self.pubsub.subscribed:
+                await asyncio.sleep(0.1)
+                continue
+            try:
+                message = await self.pubsub.get_message(timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Chatroom pub/sub read failed")
+                await asyncio.sleep(1.0)
+                continue
+            if message is None:
+                continue
+            chatroom_id = int(message["channel"].split(":")[1])
+            event = json.loads(message["data"])
+            for subscription in list(self.subscribers.get(chatroom_id, ())):
+                subscription.offer(event)
@@ -0,0 +1,130 @@
+# app/utils/vector_index.py
+#
+# Per-chatroom vector index for retrieving older messages.
+#
+# Each chatroom has two append-only files: `<id>-<dim>.vec` (float32 rows,
+# already L2-normalised) and `<id>-<dim>.ids` (int64 message ids). Appends
+# take an exclusive flock and skip ids already in the index, so several worker
+# processes and scripts/backfill_vector_index.py can index the same chatroom.
+# Searches memory-map the vector file (the OS page cache is shared between
+# processes) and do one matrix-vector product plus argpartition.
+
+import fcntl
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from app.config import VECTOR_INDEX_DIR, VECTOR_INDEX_CACHE
+from app.utils.embeddings import normalize
+
+
+class ChatroomIndex:
+    def __init__(self, chatroom_id: int, dim: int, directory: str = VECTOR_INDEX_DIR):
+        self.dim = dim
+        base = os.path.join(directory, f"{chatroom_id}-{dim}")
+        self.vec_path = base + ".vec"
+        self.ids_path = base + ".ids"
+        self.lock_path = base + ".lock"
+        # (vectors, ids, count), replaced as a whole: cached indexes are shared by threads
+        self._loaded = self._empty()
+        self._load_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def __len__(self):
+        return self._rows_on_disk()
+
+    def add(self, ids, vectors):
+        """
+        Appends message ids and their embeddings (normalised here if needed).
+        Ids already in the index are skipped.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        vectors = normalize(np.asarray(vectors, dtype=np.float32).reshape(len(ids), self.dim))
+        with open(self.lock_path, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                # A crash between the two writes below leaves extra (or partial)
+                # bytes; cut both files back to the last complete row first
+                rows = self._rows_on_disk()
+                for path, size in ((self.ids_path, rows * 8), (self.vec_path, rows * self.dim * 4)):
+                    if os.path.exists(path) and os.path.getsize(path) > size:
+                        os.truncate(path, size)
+                new = ~np.isin(ids, self.ids())
+                if not new.any():
+                    return
+                ids, vectors = ids[new], vectors[new]
+                # Vectors first: readers size the index by the ids file
+                with open(self.vec_path, "ab") as f:
+                    f.write(vectors.tobytes())
+                with open(self.ids_path, "ab") as f:
+                    f.write(ids.tobytes())
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def ids(self) -> np.ndarray:
+        """
+        Returns the message ids in the index, in the order they were added.
+        """
+        return self._load()[1]
+
+    def search(self, query, k: int, exclude_ids=()):
+        """
+        Returns up to k (message_id, cosine similarity) pairs, best first.
+        """
+        vectors, ids = self._load()
+        if not len(ids):
+            return []
+        query = normalize(np.asarray(query, dtype=np.float32).reshape(1, self.dim))[0]
+        scores = vectors @ query
+        if exclude_ids:
+            scores = scores.copy()
+            scores[np.isin(ids, np.fromiter(exclude_ids, dtype=np.int64))] = -np.inf
+        k = min(k, len(scores))
+        top = np.argpartition(scores, -k)[-k:]
+        top = top[np.argsort(scores[top])[::-1]]
+        return [(int(ids[i]), float(scores[i])) for i in top if np.isfinite(scores[i])]
+
+    def _rows_on_disk(self) -> int:
+        try:
+            return os.path.getsize(self.ids_path) // 8
+        except FileNotFoundError:
+            return 0
+
+    def _empty(self):
+        return np.empty((0, self.dim), dtype=np.float32), np.empty(0, dtype=np.int64), 0
+
+    def _load(self):
+        with self._load_lock:
+            _, known, loaded = self._loaded
+            count = self._rows_on_disk()
+            if not count:
+                self._loaded = self._empty()
+            elif count != loaded:
+                # Re-map only when other processes (or we) appended rows
+                vectors = np.memmap(self.vec_path, dtype=np.float32, mode="r", shape=(count, self.dim))
+                # Ids are small; read only the ones appended since the last load
+                if len(known) > count:
+                    known = known[:0]
+                new_ids = np.fromfile(self.ids_path, dtype=np.int64, count=count - len(known), offset=len(known) * 8)
+                self._loaded = (vectors, np.concatenate([known, new_ids]), count)
+            vectors, ids, _ = self._loaded
+            return vectors, ids
+
+
+# Recently used chatroom indexes in this process
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+def get_chatroom_index(chatroom_id: int, dim: int) -> ChatroomIndex:
+    key = (chatroom_id, dim)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = ChatroomIndex(chatroom_id, dim)
+            if len(_indexes) > VECTOR_INDEX_CACHE:
+                _indexes.popitem(last=False)
+        else:
+            _indexes.move_to_end(key)
+        return index
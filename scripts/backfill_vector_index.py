@@ -0,0 +1,88 @@
+"""
+Index the existing history of chatrooms for retrieval (RAG_ENABLED).
+
+The worker only indexes the messages it handles while RAG_ENABLED is on.
+This script embeds every other message of each chatroom, on every shard, in
+batches and appends them to the chatroom's index under VECTOR_INDEX_DIR (the
+same EMBEDDER and EMBEDDING_DIM as the workers). Messages already in an
+index are skipped, so it can run next to the workers and be run again, e.g.
+after a period with retrieval turned off. Apology replies for failed Gemini
+calls are not indexed, as in the worker.
+
+Usage:
+    python scripts/backfill_vector_index.py
+    python scripts/backfill_vector_index.py --chatroom 12 --chatroom 40
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import numpy as np
+from sqlalchemy import select
+
+from app.models import Chatroom, Message
+from app.resources import resources
+from app.tasks import FALLBACK_REPLY
+from app.utils.vector_index import ChatroomIndex
+
+BATCH = 100
+
+
+async def backfill_chatroom(session_factory, embedder, chatroom_id: int) -> int:
+    """
+    Indexes the chatroom's messages that are not in its index yet; returns how many.
+    """
+    index = ChatroomIndex(chatroom_id, embedder.dim)
+    known = set(index.ids().tolist())
+    added = 0
+    async with session_factory() as db:
+        result = await db.stream(
+            select(Message.id, Message.content)
+            .where(Message.chatroom_id == chatroom_id, Message.content != FALLBACK_REPLY)
+            .order_by(Message.id)
+        )
+        async for batch in result.partitions(BATCH):
+            batch = [(message_id, content) for message_id, content in batch if message_id not in known]
+            if not batch:
+                continue
+            ids = np.array([message_id for message_id, _ in batch], dtype=np.int64)
+            # Embedding is blocking (and remote with EMBEDDER=gemini)
+            vectors = await asyncio.to_thread(embedder.embed, [content for _, content in batch])
+            index.add(ids, vectors)
+            added += len(batch)
+    return added
+
+
+async def backfill(chatroom_ids: list):
+    resources.open_database()
+    embedder = resources.embedder
+    try:
+        for shard, session_factory in enumerate(resources.session_factories):
+            async with session_factory() as db:
+                query = select(Chatroom.id).order_by(Chatroom.id)
+                if chatroom_ids:
+                    query = query.where(Chatroom.id.in_(chatroom_ids))
+                shard_chatrooms = (await db.scalars(query)).all()
+            for chatroom_id in shard_chatrooms:
+                added = await backfill_chatroom(session_factory, embedder, chatroom_id)
+                print(f"Shard {shard}, chatroom {chatroom_id}: indexed {added} message(s)", flush=True)
+    finally:
+        resources.close_clients()
+        for engine in resources.engines:
+            await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chatroom", type=int, action="append", default=[],
+                        help="only this chatroom (repeatable; default: all chatrooms)")
+    args = parser.parse_args()
+    asyncio.run(backfill(args.chatroom))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Request latency with logging off, synchronous, and through app.utils.log.
+
+Simulates N concurrent requests on one event loop. Each request does a few
+short awaits (standing in for DB/Redis round trips) and logs a record after
+each one, the way SQL echo does. The log sink is a stream whose writes take
+--sink-delay ms (a slow terminal, a full pipe, a log shipper applying
+backpressure). Synchronous handlers make every request wait for those writes;
+the queue pipeline only enqueues and drops records when it falls behind.
+
+Usage:
+    python scripts/bench_logging.py --requests 2000 --concurrency 100 --sink-delay 0.2
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.utils import log
+
+
+class SlowSink:
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.lines = 0
+
+    def write(self, text):
+        time.sleep(self.delay)
+        self.lines += text.count("\n")
+
+    def flush(self):
+        pass
+
+
+async def request(logger, i, records):
+    started = time.perf_counter()
+    for n in range(records):
+        await asyncio.sleep(0.001)
+        logger.info("SELECT messages.id, messages.content FROM messages WHERE messages.chatroom_id = %s", i,
+                    extra={"step": n})
+    return (time.perf_counter() - started) * 1000
+
+
+async def run(total, concurrency, records):
+    logger = logging.getLogger("app.bench")
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited(i):
+        async with semaphore:
+            token = log.request_id_var.set(f"bench-{i}")
+            try:
+                return await request(logger, i, records)
+            finally:
+                log.request_id_var.reset(token)
+
+    return await asyncio.gather(*(limited(i) for i in range(total)))
+
+
+def configure(mode, sink):
+    root = logging.getLogger()
+    root.handlers.clear()
+    if mode == "off":
+        root.setLevel(logging.WARNING)
+    elif mode == "sync":
+        # What SQLAlchemy echo=True and the default handlers do
+        handler = logging.StreamHandler(sink)
+        handler.addFilter(log.RequestIdFilter())
+        handler.setFormatter(log.JsonFormatter())
+        root.addHandler(handler)
+        root.setLevel(logging.INFO)
+    else:
+        # setup_logging writes to sys.stdout
+        sys.stdout = sink
+        log.setup_logging()
+        root.setLevel(logging.INFO)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--records", type=int, default=5, help="log records per request")
+    parser.add_argument("--sink-delay", type=float, default=0.2, help="ms per write to the log sink")
+    args = parser.parse_args()
+
+    out = sys.stdout
+    for mode in ("off", "sync", "queue"):
+        sink = SlowSink(args.sink_delay / 1000)
+        configure(mode, sink)
+        started = time.perf_counter()
+        latencies = sorted(asyncio.run(run(args.requests, args.concurrency, args.records)))
+        elapsed = time.perf_counter() - started
+        dropped = 0
+        if mode == "queue":
+            dropped = log._listener.queue_handler.dropped
+            log.shutdown_logging()
+            sys.stdout = out
+        p50 = statistics.median(latencies)
+        p99 = latencies[int(len(latencies) * 0.99) - 1]
+        print(f"{mode:>5}: p50 {p50:7.1f} ms  p99 {p99:7.1f} ms  {args.requests / elapsed:7.0f} req/s  "
+              f"written {sink.lines}  dropped {dropped}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Event-loop latency during a login storm.
+
+Runs a ticker that sleeps 5 ms at a time and records how late each wake-up is
+(event-loop lag, which every other request on the worker would also see),
+while N concurrent password hashes/verifications are in progress. Compares
+hashing inline on the loop with app.utils.passwords (bounded thread pool).
+
+Usage:
+    python scripts/bench_passwords.py --requests 200
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.config import PASSWORD_HASH_WORKERS
+from app.resources import resources
+from app.utils import passwords
+
+
+async def measure_lag(stop: asyncio.Event, samples: list):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(0.005)
+        samples.append((time.perf_counter() - started - 0.005) * 1000)
+
+
+async def inline_login(stored_hash):
+    passwords.hasher.verify(stored_hash, "correct horse")
+
+
+async def pooled_login(stored_hash):
+    await passwords.verify_password(stored_hash, "correct horse")
+
+
+async def run(login, stored_hash, requests):
+    stop = asyncio.Event()
+    samples = []
+    ticker = asyncio.create_task(measure_lag(stop, samples))
+    started = time.perf_counter()
+    await asyncio.gather(*(login(stored_hash) for _ in range(requests)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await ticker
+    samples.sort()
+    p99 = samples[max(0, int(len(samples) * 0.99) - 1)] if samples else float("nan")
+    median = statistics.median(samples) if samples else float("nan")
+    max_lag = samples[-1] if samples else float("nan")
+    print(f"{login.__name__:>13}: {requests} logins in {elapsed:.2f}s, "
+          f"loop lag p50={median:.1f}ms p99={p99:.1f}ms max={max_lag:.1f}ms ({len(samples)} ticks)")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    stored_hash = passwords.hasher.hash("correct horse")
+    print(f"argon2 cost: time={passwords.hasher.time_cost} memory={passwords.hasher.memory_cost}KiB "
+          f"workers={PASSWORD_HASH_WORKERS}")
+    await run(inline_login, stored_hash, args.requests)
+    await run(pooled_login, stored_hash, args.requests)
+    resources.close_clients()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
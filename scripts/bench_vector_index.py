@@ -0,0 +1,73 @@
+"""
+Retrieval latency of the per-chatroom vector index.
+
+Builds an index of N random messages in a temporary directory (appending in
+batches, as the worker does), then times top-k searches through the
+memory-mapped file. A search reads the whole index, so it also times the
+bare matrix-vector product over the same array in memory: that is the
+floor on this machine, and the difference is the index's own overhead.
+
+Usage:
+    python scripts/bench_vector_index.py --messages 100000 --dim 64 --k 5
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.config import EMBEDDING_DIM
+from app.utils.vector_index import ChatroomIndex
+
+
+def percentiles(timings):
+    timings = sorted(timings)
+    return f"p50={statistics.median(timings):.2f}ms p99={timings[int(len(timings) * 0.99) - 1]:.2f}ms"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=100_000)
+    parser.add_argument("--dim", type=int, default=EMBEDDING_DIM)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as directory:
+        index = ChatroomIndex(1, args.dim, directory=directory)
+        started = time.perf_counter()
+        for start in range(0, args.messages, 10_000):
+            count = min(10_000, args.messages - start)
+            index.add(np.arange(start, start + count), rng.standard_normal((count, args.dim), dtype=np.float32))
+        print(f"indexed {len(index)} vectors ({os.path.getsize(index.vec_path) / 2**20:.0f} MiB) "
+              f"in {time.perf_counter() - started:.2f}s")
+
+        index.search(rng.standard_normal(args.dim), args.k)  # map the file
+        exclude = set(range(args.messages - 20, args.messages))  # recent window, as in gemini_task
+        timings = []
+        for _ in range(args.queries):
+            query = rng.standard_normal(args.dim)
+            started = time.perf_counter()
+            index.search(query, args.k, exclude_ids=exclude)
+            timings.append((time.perf_counter() - started) * 1000)
+        print(f"top-{args.k} search over {args.messages} vectors: {percentiles(timings)}")
+
+        vectors = np.fromfile(index.vec_path, dtype=np.float32).reshape(-1, args.dim)
+        floor = []
+        for _ in range(args.queries):
+            query = rng.standard_normal(args.dim, dtype=np.float32)
+            started = time.perf_counter()
+            vectors @ query
+            floor.append((time.perf_counter() - started) * 1000)
+        print(f"bare matvec over the same {args.messages} x {args.dim} array: {percentiles(floor)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Concurrent WebSocket benchmark for /chatroom/{id}/ws.
+
+Opens N sockets against one chatroom on a single API worker, sends messages
+over one of them and measures how long each event takes to reach every
+socket (Redis pub/sub fan-out included).
+
+Usage:
+    uvicorn app.main:app --port 9002 --workers 1
+    python scripts/bench_ws.py --token <jwt> --chatroom 1 --sockets 1000 --messages 5
+
+Basic users are limited to 5 messages a day; use a Pro user for larger runs.
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+import websockets
+
+
+async def open_socket(url):
+    return await websockets.connect(url, max_queue=None, open_timeout=30)
+
+
+async def wait_for_content(socket, content):
+    while True:
+        event = json.loads(await socket.recv())
+        if event.get("type") == "message" and event["message"]["content"] == content:
+            return time.perf_counter()
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="ws://localhost:9002")
+    parser.add_argument("--token", required=True)
+    parser.add_argument("--chatroom", type=int, required=True)
+    parser.add_argument("--sockets", type=int, default=500)
+    parser.add_argument("--messages", type=int, default=5)
+    args = parser.parse_args()
+
+    url = f"{args.url}/chatroom/{args.chatroom}/ws?token={args.token}"
+    started = time.perf_counter()
+    sockets = await asyncio.gather(*(open_socket(url) for _ in range(args.sockets)))
+    print(f"opened {len(sockets)} sockets in {time.perf_counter() - started:.2f}s")
+
+    latencies = []
+    for i in range(args.messages):
+        content = f"bench-{time.time_ns()}-{i}"
+        waiters = [asyncio.create_task(wait_for_content(s, content)) for s in sockets]
+        sent = time.perf_counter()
+        await sockets[0].send('{"content": "%s"}' % content)
+        received = await asyncio.gather(*waiters)
+        latencies.extend((t - sent) * 1000 for t in received)
+
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+    print(f"fan-out latency over {len(latencies)} deliveries: "
+          f"p50={statistics.median(latencies):.1f}ms p99={p99:.1f}ms max={latencies[-1]:.1f}ms")
+
+    await asyncio.gather(*(s.close() for s in sockets))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,116 @@
+"""
+Fault-injecting Gemini stub, plus a driver that hammers GeminiClient against it.
+
+Serve a stub that answers generateContent with configurable latency and
+failure rates:
+    python scripts/gemini_stub.py serve --port 9100 --latency-ms 200 --rate-429 0.2 --rate-5xx 0.05 --retry-after 2
+
+Point the worker at it (GEMINI_API_URL=http://localhost:9100) or drive the
+client directly and watch the concurrency limit and breaker react:
+    GEMINI_API_URL=http://localhost:9100 python scripts/gemini_stub.py drive --threads 32 --seconds 30
+
+`--capacity N` makes the stub return 429 whenever more than N requests are in
+flight, which is what the AIMD limiter should converge to. Pass the same
+value to `drive` to check that it does (exits 1 otherwise):
+    python scripts/gemini_stub.py serve --port 9100 --capacity 4 --retry-after 0
+    GEMINI_API_URL=http://localhost:9100 python scripts/gemini_stub.py drive --seconds 20 --capacity 4
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+
+def serve(args):
+    import uvicorn
+    from fastapi import FastAPI, Response
+
+    app = FastAPI()
+    state = {"in_flight": 0}
+
+    @app.post("/models/{model}:generateContent")
+    async def generate(model: str, body: dict):
+        state["in_flight"] += 1
+        try:
+            if args.capacity and state["in_flight"] > args.capacity:
+                return Response(status_code=429, headers={"Retry-After": str(args.retry_after)})
+            roll = random.random()
+            if roll < args.rate_429:
+                return Response(status_code=429, headers={"Retry-After": str(args.retry_after)})
+            if roll < args.rate_429 + args.rate_5xx:
+                return Response(status_code=503)
+            await asyncio.sleep(random.expovariate(1000 / args.latency_ms) if args.latency_ms else 0)
+            prompt = body["contents"][-1]["parts"][0]["text"]
+            return {
+                "candidates": [{"content": {"role": "model", "parts": [{"text": f"echo: {prompt}"}]}}],
+                "usageMetadata": {"promptTokenCount": len(prompt.split()), "candidatesTokenCount": 3},
+            }
+        finally:
+            state["in_flight"] -= 1
+
+    uvicorn.run(app, port=args.port, log_level="warning")
+
+
+def drive(args):
+    from app.utils.gemini import GeminiClient, GeminiUnavailable
+
+    client = GeminiClient(api_key="stub")
+    stop = time.monotonic() + args.seconds
+    counts = {"ok": 0, "unavailable": 0}
+
+    def worker():
+        while time.monotonic() < stop:
+            try:
+                client.generate([{"role": "user", "parts": [{"text": "hello"}]}])
+                counts["ok"] += 1
+            except GeminiUnavailable as exc:
+                counts["unavailable"] += 1
+                # What the Celery task does: back off for retry_after
+                time.sleep(min(exc.retry_after, 1.0))
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    limits = []
+    while time.monotonic() < stop:
+        time.sleep(1)
+        metrics = client.metrics()
+        limits.append(metrics["concurrency_limit"])
+        print(counts, metrics, flush=True)
+
+    if args.capacity:
+        # Judge the second half, after the limit had time to find the capacity
+        settled = limits[len(limits) // 2:]
+        mean = sum(settled) / len(settled)
+        print(f"mean concurrency limit {mean:.1f} over the last {len(settled)}s, stub capacity {args.capacity}")
+        if not args.capacity / 2 <= mean <= args.capacity * 1.5:
+            sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="command", required=True)
+    serve_parser = sub.add_parser("serve")
+    serve_parser.add_argument("--port", type=int, default=9100)
+    serve_parser.add_argument("--latency-ms", type=float, default=200)
+    serve_parser.add_argument("--rate-429", type=float, default=0.0)
+    serve_parser.add_argument("--rate-5xx", type=float, default=0.0)
+    serve_parser.add_argument("--retry-after", type=int, default=2)
+    serve_parser.add_argument("--capacity", type=int, default=0)
+    drive_parser = sub.add_parser("drive")
+    drive_parser.add_argument("--threads", type=int, default=32)
+    drive_parser.add_argument("--seconds", type=int, default=30)
+    drive_parser.add_argument("--capacity", type=int, default=0,
+                              help="the stub's --capacity; check that the limit settles near it")
+    args = parser.parse_args()
+    serve(args) if args.command == "serve" else drive(args)
+
+
+if __name__ == "__main__":
+    main()
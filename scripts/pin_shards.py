@@ -0,0 +1,115 @@
+"""
+Pin users to the shard that holds their rows before the ring changes.
+
+Adding a URL to SHARD_DATABASE_URLS (or turning sharding on for an existing
+database) makes the ring send about 1/N of the users to a shard that has none
+of their rows. Run this with the CURRENT list and the new shard count first:
+it finds every user with chatrooms, and where the new ring would pick another
+shard, records the shard that holds the rows in `user_shards`. Then
+deploy the new list. Users keep being served from their old shard and can be
+moved over later with scripts/rebalance_user.py, which drops the override
+once the user is on the ring's shard.
+
+Users who create their first chatroom between this run and the restart are
+not pinned; run the script once more right after the restart (with the new
+list) to pin them too. Users found with rows on more than one shard are only
+reported.
+
+Usage:
+    SHARD_DATABASE_URLS=<current list> python scripts/pin_shards.py --shards 4
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import redis.asyncio as aioredis
+from sqlalchemy import select
+
+from app.config import REDIS_URL, SHARD_CACHE_TTL
+from app.models import Chatroom, UserShard
+from app.resources import resources
+from app.sharding import HashRing, user_shard_key, cache_value
+
+BATCH = 1000
+
+
+async def find_owners() -> dict:
+    """
+    Returns {user_id: set of shards holding their chatrooms}.
+    """
+    owners = defaultdict(set)
+    for shard, session_factory in enumerate(resources.session_factories):
+        async with session_factory() as db:
+            result = await db.stream_scalars(select(Chatroom.user_id).distinct())
+            async for user_id in result:
+                owners[user_id].add(shard)
+    return owners
+
+
+async def load_user_shards():
+    async with resources.session_factory() as db:
+        rows = (await db.execute(select(UserShard.user_id, UserShard.shard, UserShard.moving_to))).all()
+    overrides = {user_id: shard for user_id, shard, _ in rows if shard is not None}
+    moving = {user_id for user_id, _, moving_to in rows if moving_to is not None}
+    return overrides, moving
+
+
+async def store_pins(redis_client, pins: dict):
+    # Table first, then overwrite the cached "ring" answers for these users
+    async with resources.session_factory() as db:
+        db.add_all([UserShard(user_id=user_id, shard=shard) for user_id, shard in pins.items()])
+        await db.commit()
+    pipe = redis_client.pipeline(transaction=False)
+    for user_id, shard in pins.items():
+        pipe.set(user_shard_key(user_id), cache_value(shard), ex=SHARD_CACHE_TTL)
+    await pipe.execute()
+
+
+async def pin(shards: int, dry_run: bool):
+    redis_client = aioredis.from_url(REDIS_URL, decode_responses=True)
+    resources.open_database()
+    try:
+        if shards < len(resources.engines):
+            raise SystemExit(f"--shards {shards} is fewer than the {len(resources.engines)} configured")
+        new_ring = HashRing(shards)
+        overrides, moving = await load_user_shards()
+
+        pins = {}
+        for user_id, held in sorted((await find_owners()).items()):
+            if len(held) > 1 or user_id in moving:
+                print(f"User {user_id}: rows on shards {sorted(held)}"
+                      f"{' (being moved)' if user_id in moving else ''}; not pinned")
+                continue
+            shard = held.pop()
+            current = overrides.get(user_id)
+            if current is not None and current != shard:
+                print(f"User {user_id}: override says shard {current} but rows are on {shard}; not pinned")
+            elif current is None and new_ring.shard_for(user_id) != shard:
+                pins[user_id] = shard
+
+        print(f"{len(pins)} user(s) to pin for {shards} shards")
+        if pins and not dry_run:
+            items = list(pins.items())
+            for start in range(0, len(items), BATCH):
+                await store_pins(redis_client, dict(items[start:start + BATCH]))
+    finally:
+        await redis_client.aclose()
+        for engine in resources.engines:
+            await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--shards", type=int, required=True, help="number of shards in the new list")
+    parser.add_argument("--dry-run", action="store_true", help="only report what would be pinned")
+    args = parser.parse_args()
+    asyncio.run(pin(args.shards, args.dry_run))
+
+
+if __name__ == "__main__":
+    main()
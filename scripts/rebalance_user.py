@@ -0,0 +1,143 @@
+"""
+Move one user's chatrooms and messages to another shard.
+
+Steps (if the script dies before step 3, run it again; after step 3 the
+user is already served from the target and at worst orphan rows remain on
+the source):
+  1. set the user's `moving_to` in `user_shards` (API writes answer 503,
+     Gemini tasks retry later) and wait a grace period for writes already
+     past the check;
+  2. copy the rows, keeping their ids, into the target shard in one
+     transaction (rows left there by an earlier failed run are replaced);
+  3. point the user's override at the target (or drop it if the ring
+     already maps the user there) and clear `moving_to`;
+  4. delete the rows from the source shard and invalidate the user's ETags.
+
+The source is the shard the user resolves to now. If the ring already
+changed without the user being pinned first (scripts/pin_shards.py), that is
+the wrong shard: pass the shard that holds the rows with --source.
+
+Usage:
+    SHARD_DATABASE_URLS=... python scripts/rebalance_user.py 42 1
+    SHARD_DATABASE_URLS=... python scripts/rebalance_user.py 42 3 --source 1
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import redis.asyncio as aioredis
+from sqlalchemy import delete, insert, select
+
+from app.config import REDIS_URL
+from app.models import Chatroom, Message
+from app.resources import resources
+from app.sharding import (
+    ring, resolve_shard, get_user_shard, store_user_shard, save_id_counters, restore_id_counters,
+)
+from app.utils.etag import user_version_key, chatroom_version_key, bump_versions
+
+BATCH = 1000
+
+
+async def _delete_rows(session, user_id):
+    chatroom_ids = select(Chatroom.id).where(Chatroom.user_id == user_id)
+    await session.execute(delete(Message).where(Message.chatroom_id.in_(chatroom_ids)))
+    await session.execute(delete(Chatroom).where(Chatroom.user_id == user_id))
+
+
+async def copy_rows(source: int, target: int, user_id: int) -> list:
+    """
+    Copies the user's chatrooms and messages from `source` to `target`.
+    Returns the chatroom ids.
+    """
+    async with resources.session_factories[source]() as src, resources.session_factories[target]() as dst:
+        chatrooms = (await src.execute(
+            select(Chatroom.__table__).where(Chatroom.user_id == user_id)
+        )).mappings().all()
+        chatroom_ids = [row["id"] for row in chatrooms]
+
+        await _delete_rows(dst, user_id)
+        # After the first write, so no other insert on the target can slip in between
+        dst_conn = await dst.connection()
+        counters = await dst_conn.run_sync(save_id_counters)
+        if chatrooms:
+            await dst.execute(insert(Chatroom.__table__), [dict(row) for row in chatrooms])
+            result = await src.stream(
+                select(Message.__table__).where(Message.chatroom_id.in_(chatroom_ids)).order_by(Message.id)
+            )
+            async for batch in result.mappings().partitions(BATCH):
+                await dst.execute(insert(Message.__table__), [dict(row) for row in batch])
+        # The copied ids belong to the source's range; new rows here continue in the target's
+        await dst_conn.run_sync(restore_id_counters, counters)
+        await dst.commit()
+    return chatroom_ids
+
+
+async def delete_rows(shard: int, user_id: int):
+    async with resources.session_factories[shard]() as session:
+        await _delete_rows(session, user_id)
+        await session.commit()
+
+
+async def point_at(redis_client, user_id: int, shard: int):
+    # Override only where the ring disagrees, and end the move in the same step
+    await store_user_shard(redis_client, user_id, None if ring.shard_for(user_id) == shard else shard)
+
+
+async def rebalance(user_id: int, target: int, grace: float, source: int = None):
+    redis_client = aioredis.from_url(REDIS_URL, decode_responses=True)
+    resources.open_database()
+    try:
+        for shard in (target, source):
+            if shard is not None and not 0 <= shard < len(resources.engines):
+                raise SystemExit(f"Unknown shard {shard}; {len(resources.engines)} configured")
+        if source is None:
+            source, _ = await resolve_shard(redis_client, user_id)
+        if source == target:
+            # Also clears a moving flag left by a run that died before copying,
+            # and with --source pins a user the ring no longer maps there
+            await point_at(redis_client, user_id, target)
+            print(f"User {user_id} is already on shard {target}")
+            return
+
+        override, _ = await get_user_shard(user_id)
+        await store_user_shard(redis_client, user_id, override, moving_to=target)
+        await asyncio.sleep(grace)
+        try:
+            chatroom_ids = await copy_rows(source, target, user_id)
+        except BaseException:
+            # Nothing has switched over; the source shard is still authoritative
+            await store_user_shard(redis_client, user_id, override)
+            raise
+
+        await point_at(redis_client, user_id, target)
+        if source != target:
+            await delete_rows(source, user_id)
+        await bump_versions(
+            redis_client, user_version_key(user_id), *(chatroom_version_key(cid) for cid in chatroom_ids)
+        )
+        print(f"Moved user {user_id} ({len(chatroom_ids)} chatrooms) from shard {source} to shard {target}")
+    finally:
+        await redis_client.aclose()
+        for engine in resources.engines:
+            await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("user_id", type=int)
+    parser.add_argument("target_shard", type=int)
+    parser.add_argument("--grace", type=float, default=5.0,
+                        help="seconds to wait after flagging the user before copying")
+    parser.add_argument("--source", type=int, default=None,
+                        help="shard holding the user's rows (default: the shard the user resolves to)")
+    args = parser.parse_args()
+    asyncio.run(rebalance(args.user_id, args.target_shard, args.grace, args.source))
+
+
+if __name__ == "__main__":
+    main()
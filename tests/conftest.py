@@ -0,0 +1,22 @@
+# tests/conftest.py
+#
+# The app reads its configuration at import time, so the test environment is
+# set up here, before any test module imports app.*: three SQLite shards in a
+# temporary directory (chatrooms and messages spread over them by user id).
+
+import os
+import sys
+import tempfile
+
+SHARDS = 3
+
+_directory = tempfile.mkdtemp(prefix="shards-")
+os.environ["SHARD_DATABASE_URLS"] = ",".join(
+    f"sqlite+aiosqlite:///{_directory}/shard{i}.db" for i in range(SHARDS)
+)
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{_directory}/shard0.db"
+os.environ["VECTOR_INDEX_DIR"] = os.path.join(_directory, "vector_index")
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "scripts"))
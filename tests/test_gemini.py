@@ -0,0 +1,144 @@
+"""
+Gemini client: circuit breaker states and how call outcomes feed the breaker
+and the AIMD limiter (the HTTP client is replaced per test).
+"""
+
+import time
+
+import httpx
+import pytest
+
+from app.utils.gemini import (
+    AIMDLimiter, CircuitBreaker, GeminiClient, GeminiError, GeminiRejected, GeminiUnavailable,
+)
+
+OK_BODY = {
+    "candidates": [{"content": {"parts": [{"text": "hi"}]}}],
+    "usageMetadata": {"promptTokenCount": 3, "candidatesTokenCount": 1},
+}
+
+
+def make_client(handler, threshold=3, reset_timeout=30.0):
+    client = GeminiClient(api_url="http://gemini.test", api_key="key")
+    client.http = httpx.Client(transport=httpx.MockTransport(handler))
+    client.breaker = CircuitBreaker(threshold=threshold, reset_timeout=reset_timeout)
+    client.limiter = AIMDLimiter(initial=8, minimum=1, maximum=32, latency_target=10)
+    return client
+
+
+def open_breaker(breaker):
+    for _ in range(breaker.threshold):
+        breaker.record_failure()
+
+
+def test_breaker_opens_at_threshold():
+    breaker = CircuitBreaker(threshold=3, reset_timeout=30)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == breaker.CLOSED
+    breaker.record_failure()
+    assert breaker.state == breaker.OPEN
+    with pytest.raises(GeminiRejected) as rejected:
+        breaker.before_call()
+    assert 29 < rejected.value.retry_after <= 30
+
+
+def test_success_resets_the_failure_count():
+    breaker = CircuitBreaker(threshold=3, reset_timeout=30)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == breaker.CLOSED
+
+
+def test_retry_after_does_not_open_on_its_own():
+    breaker = CircuitBreaker(threshold=3, reset_timeout=30)
+    breaker.record_failure(retry_after=1.0)
+    assert breaker.state == breaker.CLOSED
+    breaker.record_failure(retry_after=1.0)
+    breaker.record_failure(retry_after=1.0)
+    # Opened by the threshold, for the server's Retry-After
+    assert breaker.state == breaker.OPEN
+    assert breaker.retry_after() <= 1.0
+
+
+def test_one_probe_at_a_time():
+    breaker = CircuitBreaker(threshold=1, reset_timeout=0.01, probe_wait=2.0)
+    breaker.record_failure()
+    time.sleep(0.02)
+    breaker.before_call()
+    assert breaker.state == breaker.HALF_OPEN
+    with pytest.raises(GeminiRejected) as rejected:
+        breaker.before_call()
+    assert rejected.value.retry_after == 2.0
+
+
+def test_probe_outcome_closes_or_reopens():
+    breaker = CircuitBreaker(threshold=1, reset_timeout=0.01)
+    breaker.record_failure()
+    time.sleep(0.02)
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == breaker.OPEN
+
+    time.sleep(0.02)
+    breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == breaker.CLOSED
+    breaker.before_call()
+
+
+def test_generate_success():
+    client = make_client(lambda request: httpx.Response(200, json=OK_BODY))
+    result = client.generate([{"role": "user", "parts": [{"text": "hello"}]}])
+    assert (result.text, result.prompt_tokens, result.completion_tokens) == ("hi", 3, 1)
+    assert client.limiter.limit > 8
+    assert client.limiter.in_flight == 0
+
+
+def test_429_is_congestion_and_passes_retry_after_on():
+    client = make_client(lambda request: httpx.Response(429, headers={"Retry-After": "7"}))
+    with pytest.raises(GeminiUnavailable) as unavailable:
+        client.generate([])
+    assert unavailable.value.retry_after == 7
+    assert client.limiter.limit == 4
+    assert client.breaker.state == CircuitBreaker.CLOSED
+    assert client.throttled == 1
+
+
+def test_client_errors_do_not_count_against_the_breaker():
+    client = make_client(lambda request: httpx.Response(400, text="bad request"), threshold=1)
+    with pytest.raises(GeminiError):
+        client.generate([])
+    assert client.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_open_breaker_rejects_without_calling():
+    calls = []
+    client = make_client(lambda request: calls.append(request) or httpx.Response(200, json=OK_BODY))
+    open_breaker(client.breaker)
+    with pytest.raises(GeminiRejected):
+        client.generate([])
+    assert not calls
+    assert client.limiter.in_flight == 0
+
+
+def test_unexpected_error_during_probe_reopens_the_breaker():
+    def broken(request):
+        raise httpx.DecodingError("bad gzip")
+
+    client = make_client(broken, threshold=1, reset_timeout=0.01)
+    open_breaker(client.breaker)
+    time.sleep(0.02)
+    with pytest.raises(httpx.DecodingError):
+        client.generate([])
+    assert client.breaker.state == CircuitBreaker.OPEN
+    assert not client.breaker._probing
+    assert client.limiter.in_flight == 0
+
+    # The next probe goes through to a healthy server
+    client.http = httpx.Client(transport=httpx.MockTransport(lambda request: httpx.Response(200, json=OK_BODY)))
+    time.sleep(0.02)
+    assert client.generate([]).text == "hi"
+    assert client.breaker.state == CircuitBreaker.CLOSED
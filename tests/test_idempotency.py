@@ -0,0 +1,100 @@
+"""
+Idempotency-Key states (pending, saved, done) on an in-memory Redis.
+"""
+
+import asyncio
+
+import fakeredis
+import pytest
+from fastapi import HTTPException
+
+from app.utils import idempotency
+
+SCOPE = "message:1"
+KEY = "key-1"
+REQUEST = idempotency.fingerprint(7, "hello")
+
+
+@pytest.fixture
+def redis_client():
+    return fakeredis.FakeAsyncRedis(server=fakeredis.FakeServer(), decode_responses=True)
+
+
+def test_first_claim_owns_the_key_and_replays_after_complete(redis_client):
+    async def scenario():
+        assert await idempotency.claim(redis_client, SCOPE, KEY, REQUEST) is None
+        await idempotency.complete(redis_client, SCOPE, KEY, REQUEST, {"id": 1})
+        stored = await idempotency.claim(redis_client, SCOPE, KEY, REQUEST)
+        assert stored["state"] == idempotency.DONE
+        assert stored["response"] == {"id": 1}
+
+    asyncio.run(scenario())
+
+
+def test_key_reused_for_another_request_is_rejected(redis_client):
+    async def scenario():
+        await idempotency.claim(redis_client, SCOPE, KEY, REQUEST)
+        with pytest.raises(HTTPException) as rejected:
+            await idempotency.claim(redis_client, SCOPE, KEY, idempotency.fingerprint(7, "other"))
+        assert rejected.value.status_code == 422
+
+    asyncio.run(scenario())
+
+
+def test_released_claim_can_be_taken_again(redis_client):
+    async def scenario():
+        await idempotency.claim(redis_client, SCOPE, KEY, REQUEST)
+        await idempotency.release(redis_client, SCOPE, KEY)
+        assert await idempotency.claim(redis_client, SCOPE, KEY, REQUEST) is None
+
+    asyncio.run(scenario())
+
+
+def test_duplicate_waits_for_the_first_request(redis_client):
+    async def scenario():
+        await idempotency.claim(redis_client, SCOPE, KEY, REQUEST)
+        duplicate = asyncio.create_task(idempotency.claim(redis_client, SCOPE, KEY, REQUEST))
+        await asyncio.sleep(0.1)
+        assert not duplicate.done()
+        await idempotency.complete(redis_client, SCOPE, KEY, REQUEST, {"id": 1})
+        stored = await asyncio.wait_for(duplicate, 5)
+        assert stored["response"] == {"id": 1}
+
+    asyncio.run(scenario())
+
+
+def test_duplicate_gives_up_after_the_wait_timeout(redis_client, monkeypatch):
+    monkeypatch.setattr(idempotency, "IDEMPOTENCY_WAIT_TIMEOUT", 0.2)
+
+    async def scenario():
+        await idempotency.claim(redis_client, SCOPE, KEY, REQUEST)
+        with pytest.raises(HTTPException) as conflict:
+            await idempotency.claim(redis_client, SCOPE, KEY, REQUEST)
+        assert conflict.value.status_code == 409
+
+    asyncio.run(scenario())
+
+
+def test_saved_follow_up_is_handed_to_one_retry(redis_client, monkeypatch):
+    monkeypatch.setattr(idempotency, "IDEMPOTENCY_WAIT_TIMEOUT", 0.2)
+
+    async def scenario():
+        await idempotency.claim(redis_client, SCOPE, KEY, REQUEST)
+        await idempotency.mark_saved(redis_client, SCOPE, KEY, REQUEST, {"id": 1})
+        # The first request still runs the follow-up: a retry waits
+        with pytest.raises(HTTPException):
+            await idempotency.claim(redis_client, SCOPE, KEY, REQUEST)
+
+        # The follow-up failed: one retry takes it over, with the saved response
+        await idempotency.unlock(redis_client, SCOPE, KEY)
+        stored = await idempotency.claim(redis_client, SCOPE, KEY, REQUEST)
+        assert stored["state"] == idempotency.SAVED
+        assert stored["response"] == {"id": 1}
+        with pytest.raises(HTTPException):
+            await idempotency.claim(redis_client, SCOPE, KEY, REQUEST)
+
+        await idempotency.complete(redis_client, SCOPE, KEY, REQUEST, {"id": 1})
+        stored = await idempotency.claim(redis_client, SCOPE, KEY, REQUEST)
+        assert stored["state"] == idempotency.DONE
+
+    asyncio.run(scenario())
@@ -0,0 +1,125 @@
+"""
+Usage metering: Redis counters flushed into `usage` on the directory shard
+(tests/conftest.py), with flush generations making every flush count once.
+"""
+
+import asyncio
+from datetime import date
+
+import fakeredis
+from sqlalchemy import select
+
+from app.models import Base, Usage
+from app.resources import resources
+from app.utils.metering import (
+    DIRTY_KEY, GENERATION_KEY, record_usage, collect_dirty_usage, upsert_usage, finish_flush,
+    read_hot_usage, merge_hot_usage,
+)
+
+DAY = date(2026, 1, 15)
+
+
+def run(scenario):
+    async def main():
+        resources.open_database()
+        try:
+            async with resources.engine.begin() as conn:
+                await conn.run_sync(Base.metadata.drop_all)
+                await conn.run_sync(Base.metadata.create_all)
+            await scenario()
+        finally:
+            for engine in resources.engines:
+                await engine.dispose()
+    asyncio.run(main())
+
+
+async def usage_rows():
+    async with resources.session_factory() as db:
+        result = await db.execute(select(Usage).order_by(Usage.user_id, Usage.tier))
+        return [(u.user_id, u.tier, u.prompt_tokens, u.completion_tokens, u.calls) for u in result.scalars()]
+
+
+async def flush(redis_client):
+    user_ids, flushes, rows = collect_dirty_usage(redis_client, 100)
+    async with resources.session_factory() as db:
+        await upsert_usage(db, flushes, rows)
+    finish_flush(redis_client, user_ids)
+    return flushes, rows
+
+
+def test_flush_adds_counters_once():
+    redis_client = fakeredis.FakeRedis(server=fakeredis.FakeServer(), decode_responses=True)
+
+    async def scenario():
+        record_usage(redis_client, 1, "basic", 10, 5, day=DAY)
+        record_usage(redis_client, 1, "basic", 3, 2, day=DAY)
+        record_usage(redis_client, 2, "pro", 7, 1, day=DAY)
+        await flush(redis_client)
+        assert await usage_rows() == [(1, "basic", 13, 7, 2), (2, "pro", 7, 1, 1)]
+        assert not redis_client.smembers(DIRTY_KEY)
+
+        # Later calls are added to the same rows
+        record_usage(redis_client, 1, "basic", 1, 1, day=DAY)
+        await flush(redis_client)
+        assert await usage_rows() == [(1, "basic", 14, 8, 3), (2, "pro", 7, 1, 1)]
+
+    run(scenario)
+
+
+def test_flush_rerun_after_commit_is_skipped():
+    redis_client = fakeredis.FakeRedis(server=fakeredis.FakeServer(), decode_responses=True)
+
+    async def scenario():
+        record_usage(redis_client, 1, "basic", 10, 5, day=DAY)
+        user_ids, flushes, rows = collect_dirty_usage(redis_client, 100)
+        async with resources.session_factory() as db:
+            await upsert_usage(db, flushes, rows)
+        # Died before finish_flush: the flushing hash is still there and the
+        # user is marked dirty again; the next flush must not add it twice
+        redis_client.sadd(DIRTY_KEY, *user_ids)
+        record_usage(redis_client, 1, "basic", 1, 1, day=DAY)
+        await flush(redis_client)
+        assert await usage_rows() == [(1, "basic", 10, 5, 1)]
+        # The live counters recorded meanwhile get their own flush
+        await flush(redis_client)
+        assert await usage_rows() == [(1, "basic", 11, 6, 2)]
+
+    run(scenario)
+
+
+def test_lost_generation_counter_keeps_counting():
+    redis_client = fakeredis.FakeRedis(server=fakeredis.FakeServer(), decode_responses=True)
+
+    async def scenario():
+        record_usage(redis_client, 1, "basic", 10, 5, day=DAY)
+        await flush(redis_client)
+        redis_client.delete(GENERATION_KEY)
+        record_usage(redis_client, 1, "basic", 1, 1, day=DAY)
+        await flush(redis_client)
+        assert await usage_rows() == [(1, "basic", 11, 6, 2)]
+
+    run(scenario)
+
+
+def test_hot_usage_skips_flushing_counters_already_applied():
+    # Workers count with the sync client, the API reads with the async one
+    server = fakeredis.FakeServer()
+    redis_client = fakeredis.FakeRedis(server=server, decode_responses=True)
+    async_redis = fakeredis.FakeAsyncRedis(server=server, decode_responses=True)
+
+    async def scenario():
+        record_usage(redis_client, 1, "basic", 10, 5, day=DAY)
+        _, flushes, rows = collect_dirty_usage(redis_client, 100)
+        generation = flushes[0]["generation"]
+
+        # Not yet in Postgres: the flushing counters are part of the total
+        hot = await read_hot_usage(async_redis, 1)
+        assert merge_hot_usage(hot, None)[(DAY, "basic")]["prompt"] == 10
+
+        # Applied but not yet dropped from Redis: counted once, from Postgres
+        async with resources.session_factory() as db:
+            await upsert_usage(db, flushes, rows)
+        hot = await read_hot_usage(async_redis, 1)
+        assert (DAY, "basic") not in merge_hot_usage(hot, generation)
+
+    run(scenario)
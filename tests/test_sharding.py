@@ -0,0 +1,153 @@
+"""
+Shard routing and rebalancing on temporary SQLite shards (tests/conftest.py)
+with an in-memory Redis.
+
+Users write through the same routing the API uses; each user's rows must be
+on the shard the ring picks. Moving a user with scripts/rebalance_user.py
+must move the rows and the override, also with the Redis cache flushed; a
+user moved down from the last shard must not drag shard 0's new ids into
+its range. Pinning for one more shard with scripts/pin_shards.py must keep
+every user the larger ring would move on the shard holding their rows.
+"""
+
+import asyncio
+from collections import Counter
+
+import fakeredis
+import pytest
+import redis.asyncio as aioredis
+from sqlalchemy import func, select
+
+from app.crud import add_message
+from app.models import Base, Chatroom, Message, User
+from app.resources import resources
+from app.sharding import ID_RANGE, HashRing, ensure_id_range, ring, resolve_shard, get_user_shard
+import pin_shards
+import rebalance_user
+
+USERS = 60
+
+
+async def count_rows(shard, user_id):
+    async with resources.session_factories[shard]() as db:
+        chatrooms = await db.scalar(select(func.count(Chatroom.id)).where(Chatroom.user_id == user_id))
+        messages = await db.scalar(select(func.count(Message.id)).where(Message.user_id == user_id))
+    return chatrooms, messages
+
+
+async def create_rows(user_id, shard, name, messages):
+    async with resources.session_factories[shard]() as db:
+        chatroom = Chatroom(name=name, user_id=user_id)
+        db.add(chatroom)
+        await db.flush()
+        for i in range(messages):
+            message = await add_message(db, chatroom.id, user_id, f"message {i}", "user")
+        await db.commit()
+    return chatroom.id, message.id
+
+
+async def setup_shards(redis_client):
+    resources.open_database()
+    for shard, engine in enumerate(resources.engines):
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.drop_all)
+            await conn.run_sync(Base.metadata.create_all)
+            await conn.run_sync(ensure_id_range, shard)
+    async with resources.session_factory() as directory_db:
+        directory_db.add_all([User(id=user_id, mobile=str(user_id)) for user_id in range(1, USERS + 1)])
+        await directory_db.commit()
+    for user_id in range(1, USERS + 1):
+        shard, _ = await resolve_shard(redis_client, user_id)
+        chatroom_id, message_id = await create_rows(user_id, shard, f"room {user_id}", 3)
+        assert chatroom_id // ID_RANGE == message_id // ID_RANGE == shard
+
+
+@pytest.fixture
+def redis_client(monkeypatch):
+    # The scripts open their own client from REDIS_URL; all of them share one server
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(aioredis, "from_url", lambda *args, **kwargs: fakeredis.FakeAsyncRedis(
+        server=server, decode_responses=True
+    ))
+    return fakeredis.FakeAsyncRedis(server=server, decode_responses=True)
+
+
+async def dispose_engines():
+    for engine in resources.engines:
+        await engine.dispose()
+
+
+@pytest.fixture
+def run():
+    # One event loop per test; the engines' connections belong to it
+    loop = asyncio.new_event_loop()
+    yield loop.run_until_complete
+    loop.run_until_complete(dispose_engines())
+    loop.close()
+
+
+def test_rows_follow_the_ring(redis_client, run):
+    run(setup_shards(redis_client))
+    per_shard = Counter()
+    for user_id in range(1, USERS + 1):
+        expected = ring.shard_for(user_id)
+        for shard in range(ring.shard_count):
+            wanted = (1, 3) if shard == expected else (0, 0)
+            assert run(count_rows(shard, user_id)) == wanted, (user_id, shard)
+        per_shard[expected] += 1
+    assert len(per_shard) == ring.shard_count, "some shard received no users"
+
+
+def test_rebalance_moves_rows_and_override(redis_client, run):
+    run(setup_shards(redis_client))
+    user_id = 1
+    source = ring.shard_for(user_id)
+    target = (source + 1) % ring.shard_count
+
+    run(rebalance_user.rebalance(user_id, target, grace=0))
+    resources.open_database()
+    assert run(resolve_shard(redis_client, user_id)) == (target, False)
+    assert run(count_rows(target, user_id)) == (1, 3)
+    assert run(count_rows(source, user_id)) == (0, 0)
+
+    # The override lives in the directory database; Redis only caches it
+    run(redis_client.flushall())
+    assert run(resolve_shard(redis_client, user_id)) == (target, False)
+
+    # Moving back to the ring's shard drops the override again
+    run(rebalance_user.rebalance(user_id, source, grace=0))
+    resources.open_database()
+    assert run(get_user_shard(user_id)) == (None, None)
+    assert run(resolve_shard(redis_client, user_id)) == (source, False)
+
+
+def test_rows_moved_down_keep_new_ids_in_range(redis_client, run):
+    run(setup_shards(redis_client))
+    high = ring.shard_count - 1
+    mover = next(u for u in range(1, USERS + 1) if ring.shard_for(u) == high)
+
+    run(rebalance_user.rebalance(mover, 0, grace=0))
+    resources.open_database()
+    chatroom_id, message_id = run(create_rows(mover, 0, "after move", 1))
+    assert chatroom_id // ID_RANGE == message_id // ID_RANGE == 0
+
+    # Shard 0 still passes the startup check
+    async def check_range():
+        async with resources.engines[0].begin() as conn:
+            await conn.run_sync(ensure_id_range, 0)
+    run(check_range())
+
+
+def test_pin_shards_keeps_users_on_their_rows(redis_client, run):
+    run(setup_shards(redis_client))
+    run(pin_shards.pin(ring.shard_count + 1, dry_run=False))
+    resources.open_database()
+    bigger = HashRing(ring.shard_count + 1)
+    pinned = 0
+    for user_id in range(1, USERS + 1):
+        held = ring.shard_for(user_id)
+        override, _ = run(get_user_shard(user_id))
+        resolved = override if override is not None else bigger.shard_for(user_id)
+        assert resolved == held, f"user {user_id}: rows on shard {held}, would resolve to {resolved}"
+        pinned += override is not None
+    assert pinned